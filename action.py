@@ -1,20 +1,28 @@
-# grequests requires import first
-from backup_all import backup
-from fetch_rss import fetch
-from merge_rss import merge
+import importlib
 import sys
 
+# 只导入当前操作需要的模块，merge不需要访问网络，也不需要gevent
+# backup要在导入requests之前用gevent patch，所以不能在这里提前导入其他模块
 OPS = {
-    "fetch": fetch,
-    "merge": merge,
-    "backup": backup,
+    "fetch": ("fetch_rss", "fetch"),
+    "merge": ("merge_rss", "merge"),
+    "backup": ("backup_all", "backup"),
 }
 
+
+def run(op, *args):
+    module, func = OPS[op]
+    getattr(importlib.import_module(module), func)(*args)
+
+
 if __name__ == '__main__':
     args = sys.argv
     args_len = len(args)
     if args_len == 1:
-        fetch()
-        merge()
+        # fetch和merge在同一个进程里，中间结果直接在内存里传递，不用写__tmp__
+        importlib.import_module("frame_utils").WRITE_THROUGH = False
+        run("fetch")
+        run("merge")
     else:
-        OPS[args[1]]()
\ No newline at end of file
+        # 比如 python action.py fetch full
+        run(args[1], *args[2:])
@@ -1,26 +1,52 @@
-import grequests
+# gevent需要在requests之前patch
+from gevent import monkey
+
+monkey.patch_all()
+
+import gevent
+import gevent.lock
+import gevent.pool
 import hashlib
+import json
+import numpy
 import pandas
 import os
-from functools import wraps
+import requests
+import tarfile
+import time
+from collections import defaultdict
+from requests.adapters import HTTPAdapter
+from store_utils import read_history
+from page_utils import page_order, page_stats, read_page, PAGE_FIELDS
+from fetch_utils import SCHEDULE_MAX, SCHEDULE_SLACK, FETCH_MAX_BYTES, get_host, interleave_host
+from http_utils import HTTP_USER_AGENT, HTTP_CHUNK, HTTP_RETRY_STATUS
+from pack_utils import PackBody, PackStore
 
 
 # 因此backup是需要数据准备好之后, 这样也比较合理
 BACKUP_SOURCE = "./public/all/"
 BACKUP_PATH = "./public/backup/"
 BACKUP_STATS = "./public/backup.csv"
-
-
-def repeat(times=1):
-    def repeat_func(func):
-        print("backup", func.__name__, "repeat", times, "times")
-
-        @wraps(func)
-        def wrap(*args, **kwargs):
-            for _ in range(times):
-                func(*args, **kwargs)
-        return wrap
-    return repeat_func
+# 以前每周把<key>.html追加到这个tar包里，第一次运行时迁移进打包存储
+BACKUP_TAR = BACKUP_PATH + "backup.tar.gz"
+# 已经加到backup.csv里最新的一条的timestamp和key，下次只扫描比它新的分页
+BACKUP_MARK = "./public/backup.json"
+# 调度推迟抓取的源，最晚SCHEDULE_MAX之后才把更早的文章带进来，扫描时从mark之前这么久开始
+BACKUP_MARGIN = SCHEDULE_MAX + SCHEDULE_SLACK
+BACKUP_COLUMNS = ['key', 'title', 'author', 'home', 'rss', 'date', 'link', 'timestamp', 'path']
+# 同时下载的文章数
+BACKUP_WORKERS = 32
+# 同一个站点同时下载的文章数
+BACKUP_HOST_WORKERS = 2
+# 每篇文章最多下载几次，只重试失败的那篇
+BACKUP_RETRIES = 3
+# 第n次重试前等待BACKUP_BACKOFF * 2 ** (n - 1)秒
+BACKUP_BACKOFF = 2.0
+BACKUP_TIMEOUT = (5.0, 10.0)
+# 单篇文章最多保存多少字节，超过的部分丢掉，和抓取源时一样
+BACKUP_MAX_BYTES = FETCH_MAX_BYTES
+# 每下载完多少篇批量更新一次backup_stats
+BACKUP_FLUSH = 100
 
 
 def backup_key(url, timestamp):
@@ -30,8 +56,7 @@ def backup_key(url, timestamp):
 
 
 def get_backup_stats():
-    backup_stats = pandas.DataFrame(
-        columns=['key', 'title', 'author', 'home', 'rss', 'date', 'link', 'timestamp', 'path'])
+    backup_stats = pandas.DataFrame(columns=BACKUP_COLUMNS)
     try:
         if os.path.exists(BACKUP_STATS):
             backup_stats = pandas.read_csv(BACKUP_STATS, encoding="utf-8")
@@ -40,44 +65,206 @@ def get_backup_stats():
     return backup_stats
 
 
+def ledger_index(backup_stats):
+    """key -> 行号，查一个key是否已经在backup.csv里是O(1)"""
+    return {key: pos for pos, key in enumerate(backup_stats['key'].tolist())}
+
+
+def mark_backup(backup_stats, index, keys, path):
+    """批量更新keys对应行的path"""
+    rows = [index[key] for key in keys if key in index]
+    if rows:
+        backup_stats.iloc[rows, backup_stats.columns.get_loc('path')] = path
+
+
+def append_backup(backup_stats, source):
+    """source里还没有备份过的文章，一次性加到backup_stats后面"""
+    if source is None or len(source) <= 0:
+        return backup_stats
+    keys = pandas.Series([backup_key(link, timestamp) for link, timestamp in zip(source['link'], source['timestamp'])],
+                         index=source.index)
+    index = ledger_index(backup_stats)
+    fresh = ~keys.isin(index.keys()) & ~keys.duplicated()
+    if not fresh.any():
+        return backup_stats
+    new = source.loc[fresh.to_numpy()].assign(key=keys[fresh].to_numpy(), path='-')
+    for key in new['key']:
+        print("backup append", key)
+    new = new.reindex(columns=BACKUP_COLUMNS)
+    if len(backup_stats) <= 0:
+        return new.reset_index(drop=True)
+    return pandas.concat([backup_stats, new], ignore_index=True)
+
+
+def load_mark():
+    try:
+        with open(BACKUP_MARK, "r") as f:
+            return json.load(f)
+    except:
+        return {}
+
+
+def dump_mark(mark):
+    with open(BACKUP_MARK, "w") as f:
+        json.dump(mark, f, indent=2)
+
+
+def mark_limit():
+    """比这个时间还新的文章是时间写错了的，不能作为mark，否则之后的文章都会被跳过"""
+    return time.time() + SCHEDULE_SLACK
+
+
+def scan_source(mark, index):
+    """从新到旧读all的分页，读到整页都比mark前BACKUP_MARGIN还旧时停下；mark不可用时读全部"""
+    if not mark or mark.get("key") not in index or mark.get("timestamp", 0) > mark_limit():
+        print("backup full scan")
+        return read_history(BACKUP_SOURCE)
+    newest = PAGE_FIELDS.index("newest")
+    stats = page_stats(BACKUP_SOURCE)
+    dfs = []
+    for idx in page_order(BACKUP_SOURCE):
+        page_newest = stats[idx - 1][newest]
+        if page_newest is not None and page_newest < mark["timestamp"] - BACKUP_MARGIN:
+            break
+        dfs.append(read_page(BACKUP_SOURCE, idx))
+    print("backup scan", len(dfs), "of", len(stats), "pages")
+    return pandas.concat(dfs) if dfs else None
+
+
+def next_mark(mark, source):
+    """source中最新的一条比mark新时，作为新的mark"""
+    if source is None or len(source) <= 0:
+        return mark
+    # 多页拼起来的source行标签会重复，按位置取
+    timestamps = pandas.to_numeric(source['timestamp'], errors="coerce").to_numpy(dtype="float64", copy=True)
+    limit = mark_limit()
+    timestamps[timestamps > limit] = numpy.nan
+    if numpy.isnan(timestamps).all():
+        return mark
+    row = source.iloc[int(numpy.nanargmax(timestamps))]
+    timestamp = float(row['timestamp'])
+    if mark and limit >= mark.get("timestamp", 0) >= timestamp:
+        return mark
+    return {"timestamp": timestamp, "key": backup_key(row['link'], row['timestamp'])}
+
+
 def dump_backup_stats(backup_stats):
     backup_stats.to_csv(BACKUP_STATS, index=False,
                         sep=",", encoding="utf-8")
 
 
-@repeat(3)
+def backup_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=BACKUP_WORKERS, pool_maxsize=BACKUP_HOST_WORKERS)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["User-Agent"] = HTTP_USER_AGENT
+    return session
+
+
+def fetch_article(session, link):
+    """下载一篇文章，边下载边压缩；返回(PackBody, None)，失败时返回(None, (原因, 是否值得重试))"""
+    try:
+        with session.get(link, timeout=BACKUP_TIMEOUT, stream=True) as resp:
+            if not resp.ok:
+                return None, ("status %d" % resp.status_code, resp.status_code in HTTP_RETRY_STATUS)
+            body = PackBody()
+            for chunk in resp.iter_content(HTTP_CHUNK):
+                if body.size + len(chunk) > BACKUP_MAX_BYTES:
+                    body.update(chunk[: BACKUP_MAX_BYTES - body.size])
+                    print("backup", link, "truncated to", BACKUP_MAX_BYTES, "bytes")
+                    break
+                body.update(chunk)
+            return body, None
+    except Exception as e:
+        return None, (repr(e), True)
+
+
+def import_tar(store):
+    """以前tar包里的<key>.html放进包里；tar -u追加的同名文件以最后一个为准"""
+    if not os.path.isfile(BACKUP_TAR):
+        return
+    with tarfile.open(BACKUP_TAR) as tar:
+        members = {}
+        for member in tar:
+            name = os.path.basename(member.name)
+            if member.isfile() and name.endswith(".html"):
+                members[name[: -len(".html")]] = member
+        for key, member in members.items():
+            if not store.has(key):
+                store.put(key, tar.extractfile(member).read())
+    # index.csv写好之后再删，中途失败下次还能重新导入
+    store.flush()
+    os.remove(BACKUP_TAR)
+    print("backup", len(members), "files from", BACKUP_TAR, "packed")
+
+
+def import_loose(store):
+    """以前下载的<key>.html放进包里"""
+    if not os.path.isdir(BACKUP_PATH):
+        return
+    import_tar(store)
+    names = sorted(n for n in os.listdir(BACKUP_PATH) if n.endswith(".html"))
+    for name in names:
+        key = name[: -len(".html")]
+        if not store.has(key):
+            with open(os.path.join(BACKUP_PATH, name), "rb") as f:
+                store.put(key, f.read())
+    store.flush()
+    for name in names:
+        os.remove(os.path.join(BACKUP_PATH, name))
+    if names:
+        print("backup", len(names), "loose files packed")
+
+
 def download_article(backup_stats):
+    store = PackStore(BACKUP_PATH)
+    import_loose(store)
     keys = backup_stats.loc[backup_stats['path']
                             == '-', ['key', 'link']].to_numpy()
     if len(keys) == 0:
         return
     print("backup", len(keys), "links waiting for download")
 
-    def failed_backup(requests, exceptions):
-        print("backup failed", requests, exceptions)
+    session = backup_session()
+    hosts = defaultdict(lambda: gevent.lock.BoundedSemaphore(BACKUP_HOST_WORKERS))
+
+    def download(item):
+        key, link = item
+        for attempt in range(BACKUP_RETRIES):
+            if attempt > 0:
+                gevent.sleep(BACKUP_BACKOFF * 2 ** (attempt - 1))
+            with hosts[get_host(link)]:
+                body, failed = fetch_article(session, link)
+            if failed is None:
+                # 写包时不会切换greenlet，不需要加锁
+                store.put_body(key, body)
+                return key
+            reason, retry = failed
+            print("backup failed", link, reason, "attempt", attempt + 1)
+            if not retry:
+                break
         return None
 
-    if not os.path.exists(BACKUP_PATH):
-        os.makedirs(BACKUP_PATH)
-
-    lens = len(keys)
-    batch = 100
-    for s in range(0, lens, batch):
-        keys_batch = keys[s: s + batch]
-        reqs = [grequests.get(key[1], timeout=5.0)
-                for key in keys_batch]
-        print("backup request batch size: %d" % len(reqs))
-        resp = grequests.map(reqs, exception_handler=failed_backup)
-
-        for i, response in enumerate(resp):
-            if not response:
-                continue
-            path = os.path.join(BACKUP_PATH, keys_batch[i][0] + ".html")
-            with open(path, 'w') as f:
-                f.write(response.text)
-                backup_stats.loc[(backup_stats['key'] ==
-                                  keys_batch[i][0]), 'path'] = '+'
-                f.close()
+    # 下载完一篇就接着下一篇，不用等同一批里最慢的那个
+    index = ledger_index(backup_stats)
+    pool = gevent.pool.Pool(BACKUP_WORKERS)
+    done = []
+    finished = 0
+    # 同一个host的文章轮流排开，不然一个博客的一长串文章会在host的限制上占满所有worker
+    items = interleave_host([tuple(k) for k in keys], lambda item: get_host(item[1]))
+    for key in pool.imap_unordered(download, items):
+        if key is not None:
+            done.append(key)
+            finished += 1
+        if len(done) >= BACKUP_FLUSH:
+            # 先写index.csv，再标记已经备份
+            store.flush()
+            mark_backup(backup_stats, index, done, '+')
+            done = []
+    store.flush()
+    mark_backup(backup_stats, index, done, '+')
+    print("backup", finished, "of", len(keys), "links downloaded")
 
 
 BACKUP_STAGE_QUEUE = ['-']
@@ -87,50 +274,20 @@ BACKUP_STAGE = {
 }
 
 
-def backup():
-    index = 1
+def backup(mode=""):
+    """mode为full时不管mark，扫描all的全部数据（有parquet历史时一次读完，否则逐页读csv）"""
     backup_stats = get_backup_stats()
-    while True:
-        source_path = BACKUP_SOURCE + str(index) + ".csv"
-        if not os.path.exists(source_path):
-            break
-
-        source = pandas.read_csv(source_path, encoding="utf-8")
-        for title, author, date, link, timestamp, home, rss in zip(source['title'],
-                                                                   source['author'],
-                                                                   source['date'],
-                                                                   source['link'],
-                                                                   source['timestamp'],
-                                                                   source['home'],
-                                                                   source['rss']):
-            key = backup_key(link, timestamp)
-            if not backup_stats['key'].isin([key]).any():
-                print("backup append", key)
-                backup_stats = backup_stats.append({
-                    'key': key,
-                    'title': title,
-                    'author': author,
-                    'date': date,
-                    'link': link,
-                    'home': home,
-                    'rss': rss,
-                    'timestamp': timestamp,
-                    'path': "-",
-                }, ignore_index=True)
-
-        index += 1
+    mark = {} if mode == "full" else load_mark()
+    source = scan_source(mark, ledger_index(backup_stats))
+    backup_stats = append_backup(backup_stats, source)
     for stage in BACKUP_STAGE_QUEUE:
         if stage in BACKUP_STAGE.keys():
             BACKUP_STAGE[stage](backup_stats)
     dump_backup_stats(backup_stats)
+    # backup.csv写完之后再更新mark，中途失败下次会重新扫描
+    dump_mark(next_mark(mark, source))
 
 
 if __name__ == '__main__':
-    def failed_backup(requests, exceptions):
-        print("backup failed", requests, exceptions)
-        return None
-
-    url = 'https://baidu.com'
-    reqs = [grequests.get(url, timeout=5.0) for _ in range(100)]
-    resp = grequests.map(reqs, exception_handler=failed_backup)
-    print(resp)
+    import sys
+    backup(*sys.argv[1:])
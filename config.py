@@ -0,0 +1,37 @@
+# coding=UTF-8
+# 只放路径之类的配置，不要在这里做网络请求或者导入重型依赖
+
+# 订阅列表，在fetch的时候才去拉取
+fetch_list_source = "https://gist.githubusercontent.com/caibingcheng/adf8f300dc50a61a965bdcc6ef0aecb3/raw/rssblog-source-list.json"
+
+# 按rss提供者分类的rss
+rss_fetch_source_dir = "./__tmp__/source/"
+# 举例member
+rss_fetch_member_dir = "./__tmp__/member/"
+# 按用户分类的rss
+rss_fetch_user_dir = "./__tmp__/user/"
+# 所有的rss
+rss_fetch_all_dir = "./__tmp__/all/"
+# 按时间年月分类的rss
+rss_fetch_date_dir = "./__tmp__/date/"
+# 所有源的抓取状态（ETag/Last-Modified、调度等），每次运行只写这一个文件
+rss_fetch_state = "./public/fetch_state.json"
+# 上一次每个用户的订阅列表，用来找出新订阅的源
+rss_fetch_subscribe = "./public/subscribe.json"
+# 每个源的抓取耗时、大小、结果
+rss_fetch_report = "./public/fetch_report.json"
+
+rss_out_source_dir = "./public/source/"
+rss_out_member_dir = "./public/member/"
+rss_out_user_dir = "./public/user/"
+rss_out_all_dir = "./public/all/"
+rss_out_date_dir = "./public/date/"
+rss_out_stats_dir = "./public/"
+# public发布后的地址（public分支），和README中的数据base url一致，订阅文件的id用这个地址
+rss_out_base_url = "https://raw.githubusercontent.com/caibingcheng/rssblog-source/public/"
+# public下输出文件的摘要，内容没变的文件不再重写
+rss_out_manifest = "./public/manifest.json"
+# 每一页除了N.csv之外还导出N.json和N.ndjson，浏览器里不用再解析csv
+rss_out_page_exports = ("json", "ndjson")
+# public/all标题和作者的分片搜索索引
+rss_out_search_dir = "./public/search/"
@@ -0,0 +1,115 @@
+# coding=UTF-8
+# 每个分区的订阅文件：RSS 2.0、Atom和JSON Feed，直接按列拼出来，不再经过json和PyRSS2Gen转一遍
+
+import os
+import json
+import datetime
+from email.utils import formatdate
+from xml.sax.saxutils import escape, quoteattr
+from page_utils import read_newest
+from output_utils import write_output
+
+FEED_TITLE = "RSSBlog"
+FEED_LINK = "https://rssblog.cn/"
+FEED_DESCRIPTION = "A Site for Blog RSS."
+FEED_RSS = "rss.xml"
+FEED_ATOM = "atom.xml"
+FEED_JSON = "feed.json"
+FEED_FILES = (FEED_RSS, FEED_ATOM, FEED_JSON)
+# public的目录和它发布后的地址，用来生成每个订阅的id，merge时按config设置
+FEED_ROOT = None
+FEED_BASE = None
+
+
+def feed_id(out):
+    """分区在数据base url下的地址，订阅文件的地址是它加上文件名"""
+    path = os.path.relpath(out, FEED_ROOT).replace(os.sep, "/")
+    return FEED_BASE if path == "." else FEED_BASE + path + "/"
+
+
+def rfc822(timestamp):
+    return formatdate(timestamp, usegmt=True)
+
+
+def rfc3339(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def feed_items(df):
+    """标题、链接、作者、时间都不为空的条目，按(title, link, author, timestamp)返回"""
+    columns = ["title", "link", "author", "timestamp"]
+    if not set(columns).issubset(df.columns):
+        return []
+    df = df[columns].dropna()
+    mask = (df[["title", "link", "author"]].astype(str) != "").all(axis=1)
+    df = df[mask]
+    return list(zip(df["title"].astype(str), df["link"].astype(str), df["author"].astype(str), df["timestamp"].astype("float64")))
+
+
+def rss_feed(items, updated):
+    parts = [
+        '<?xml version="1.0" encoding="utf-8"?>\n<rss version="2.0"><channel>',
+        "<title>%s</title><link>%s</link><description>%s</description>" % (escape(FEED_TITLE), escape(FEED_LINK), escape(FEED_DESCRIPTION)),
+        "<lastBuildDate>%s</lastBuildDate><docs>http://blogs.law.harvard.edu/tech/rss</docs>" % rfc822(updated),
+    ]
+    for title, link, author, timestamp in items:
+        parts.append(
+            "<item><title>%s</title><link>%s</link><author>%s</author><pubDate>%s</pubDate></item>"
+            % (escape(title), escape(link), escape(author), rfc822(timestamp))
+        )
+    parts.append("</channel></rss>")
+    return "".join(parts)
+
+
+def atom_feed(items, updated, feed):
+    parts = [
+        '<?xml version="1.0" encoding="utf-8"?>\n<feed xmlns="http://www.w3.org/2005/Atom">',
+        "<title>%s</title><subtitle>%s</subtitle>" % (escape(FEED_TITLE), escape(FEED_DESCRIPTION)),
+        "<link href=%s/><id>%s</id><updated>%s</updated>" % (quoteattr(FEED_LINK), escape(feed), rfc3339(updated)),
+    ]
+    for title, link, author, timestamp in items:
+        parts.append(
+            "<entry><title>%s</title><link href=%s/><id>%s</id><updated>%s</updated><author><name>%s</name></author></entry>"
+            % (escape(title), quoteattr(link), escape(link), rfc3339(timestamp), escape(author))
+        )
+    parts.append("</feed>")
+    return "".join(parts)
+
+
+def json_feed(items, feed):
+    feed = {
+        "version": "https://jsonfeed.org/version/1.1",
+        "title": FEED_TITLE,
+        "home_page_url": FEED_LINK,
+        "feed_url": feed + FEED_JSON,
+        "description": FEED_DESCRIPTION,
+        "items": [
+            {
+                "id": link,
+                "url": link,
+                "title": title,
+                "authors": [{"name": author}],
+                "date_published": rfc3339(timestamp),
+            }
+            for title, link, author, timestamp in items
+        ],
+    }
+    return json.dumps(feed, ensure_ascii=False)
+
+
+def has_feeds(out):
+    return all(os.path.isfile(out + name) for name in FEED_FILES)
+
+
+def write_feeds(out, rows):
+    """用分区最新的rows条数据生成三种订阅文件，内容没变时不重写"""
+    df = read_newest(out, rows)
+    if df is None:
+        return
+    items = feed_items(df)
+    # 用最新一条的时间，没有新数据时订阅文件不变
+    updated = df["timestamp"].max()
+    feed = feed_id(out)
+    write_output(out + FEED_RSS, rss_feed(items, updated).encode("utf-8"))
+    write_output(out + FEED_ATOM, atom_feed(items, updated, feed).encode("utf-8"))
+    write_output(out + FEED_JSON, json_feed(items, feed).encode("utf-8"))
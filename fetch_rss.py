@@ -6,41 +6,56 @@ import time
 import requests
 import feedparser
 import pandas
+from concurrent.futures import ThreadPoolExecutor
 from fetch_utils import *
+from http_utils import http_get
+from config import (
+    fetch_list_source,
+    rss_fetch_source_dir,
+    rss_fetch_member_dir,
+    rss_fetch_user_dir,
+    rss_fetch_all_dir,
+    rss_fetch_date_dir,
+    rss_fetch_state,
+    rss_fetch_subscribe,
+    rss_fetch_report,
+    rss_out_source_dir,
+)
 
 requests.packages.urllib3.disable_warnings()
-fetch_list_source = "https://gist.githubusercontent.com/caibingcheng/adf8f300dc50a61a965bdcc6ef0aecb3/raw/rssblog-source-list.json"
-fetch_list = json.loads(requests.get(fetch_list_source, verify=False).text)
 
 # 所有的rss源
 rss = []
 # 根据不同用户得到的rss源
 rss_user = {}
-# 按rss提供者分类的rss
-rss_fetch_source_dir = "./__tmp__/source/"
-# 举例member
-rss_fetch_member_dir = "./__tmp__/member/"
-# 按用户分类的rss
-rss_fetch_user_dir = "./__tmp__/user/"
-# 所有的rss
-rss_fetch_all_dir = "./__tmp__/all/"
-# 按时间年月分类的rss
-rss_fetch_date_dir = "./__tmp__/date/"
-
-
-def fetch():
+
+def fetch_user_list(link):
+    rss_list = []
+    try:
+        rss_list = json.loads(http_get(link, verify=False).text)
+        for r in rss_list:
+            r = r.strip("/")
+            print(r)
+    except:
+        pass
+    return rss_list
+
+
+def get_fetch_list():
+    """所有用户的订阅列表地址，导入时不拉取，避免merge等操作也要访问网络"""
+    return json.loads(http_get(fetch_list_source, verify=False).text)
+
+
+def fetch(mode=""):
+    """mode为full时忽略调度，抓取所有的源"""
     global rss
-    for key, link in fetch_list.items():
-        rss_list = []
-        try:
-            rss_list = json.loads(requests.get(link, verify=False).text)
-            for r in rss_list:
-                r = r.strip("/")
-                print(r)
-        except:
-            pass
-        rss = rss + rss_list
-        rss_user[key] = rss_list
+    fetch_list = get_fetch_list()
+    # 每个用户的订阅列表互不相关，一起拉取
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as pool:
+        rss_lists = pool.map(fetch_user_list, fetch_list.values())
+        for key, rss_list in zip(fetch_list.keys(), rss_lists):
+            rss = rss + rss_list
+            rss_user[key] = rss_list
 
     # 所有源根据url去重
     rss = list({r: r for r in rss}.values())
@@ -49,8 +64,24 @@ def fetch():
     # rss = ["https://xxxx/feed/",]
     # rss_user["test"] = rss
 
-    fetch_source(rss_fetch_source_dir, rss)
+    fetch_source(
+        rss_fetch_source_dir,
+        rss,
+        rss_fetch_state,
+        full=mode == "full",
+        report=rss_fetch_report,
+        rss_legacy_dir=rss_out_source_dir,
+    )
     combine_source(rss_fetch_all_dir, rss_fetch_source_dir)
     combine_member(rss_fetch_member_dir, rss_fetch_all_dir)
     split_date(rss_fetch_date_dir, rss_fetch_all_dir)
-    split_user(rss_fetch_user_dir, rss_user, rss_fetch_source_dir)
+    rss_user_prev = {}
+    if os.path.isfile(rss_fetch_subscribe):
+        with open(rss_fetch_subscribe, "r") as f:
+            rss_user_prev = json.load(f)
+    split_user(
+        rss_fetch_user_dir, rss_user, rss_fetch_source_dir, rss_out_source_dir, rss_user_prev
+    )
+    os.makedirs(os.path.dirname(rss_fetch_subscribe), exist_ok=True)
+    with open(rss_fetch_subscribe, "w") as f:
+        json.dump(rss_user, f, indent=2)
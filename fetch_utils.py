@@ -3,12 +3,42 @@
 import os
 import json
 import time
-import requests
 import feedparser
 import pandas
 import hashlib
-from concurrent.futures import ThreadPoolExecutor
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from io import BytesIO
+from urllib.parse import urlparse
+from http_utils import http_get, read_limited
+from frame_utils import put_frame, has_frame, read_frame, drop_frame
+from page_utils import page_count, read_newest
+from output_utils import write_json
+
+# 全局抓取并发数
+FETCH_WORKERS = 16
+# 同一个host的并发数，避免同时打到同一个博客上
+FETCH_HOST_WORKERS = 2
+# 单个源最多下载多少字节，超过的部分丢掉，最新的条目一般在最前面
+FETCH_MAX_BYTES = 4 * 1024 * 1024
+# 以前每个源的抓取状态放在源的输出目录里的这个文件中，现在都放在一个文件里，见load_states
+FETCH_STATE = "fetch.json"
+# 调度：按照源的发布频率决定多久抓一次，间隔取发布间隔的1/SCHEDULE_RATIO
+SCHEDULE_RATIO = 4
+# 最长多久必须抓一次
+SCHEDULE_MAX = 3 * 24 * 3600
+# 连续失败时的退避起点，每失败一次翻倍
+SCHEDULE_FAILURE_BASE = 6 * 3600
+# 记录最近多少次发布间隔
+SCHEDULE_INTERVALS = 10
+# cron实际执行的时间有偏差，提前这么久到期的源也算到期
+SCHEDULE_SLACK = 3600
+# 抓取报告里列出最慢的多少个源
+REPORT_TOP = 20
+# 新订阅的源没有更新时，从public中补上的条数，和merge的一页一样多
+SUBSCRIBE_ROWS = 50
+# 抓取结果的字段，没有新数据时也按这个格式写空表
+COLUMNS = ["title", "author", "link", "home", "rss", "date", "timestamp"]
 
 
 def hash_url(url):
@@ -26,67 +56,339 @@ def get_entry_date(entry):
         return time.localtime()
 
 
-def fetch_source(rss_fetch_source_dir, rss):
-    """按照来源抓取rss，放到每个源对应的new.csv中"""
+def empty_frame():
+    return pandas.DataFrame(columns=COLUMNS)
+
+
+def load_json(path):
+    """没有或者损坏时返回空"""
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except:
+        return {}
+
+
+def load_states(state_path, legacy_dir=None):
+    """所有源的抓取状态，url的hash -> state
+
+    legacy_dir下还有以前每个源一个的fetch.json时，读进来之后删掉，下次写到state_path中
+    """
+    states = load_json(state_path)
+    if legacy_dir and os.path.isdir(legacy_dir):
+        for url_hash in os.listdir(legacy_dir):
+            path = legacy_dir + url_hash + "/" + FETCH_STATE
+            if os.path.isfile(path):
+                states.setdefault(url_hash, load_json(path))
+                os.remove(path)
+    return states
+
+
+def dump_states(state_path, states):
+    """每次运行只写一次，内容没变时不写"""
+    os.makedirs(os.path.dirname(state_path), exist_ok=True)
+    write_json(state_path, states, indent=2, sort_keys=True)
+
+
+def conditional_headers(state):
+    headers = {}
+    if state.get("etag"):
+        headers["If-None-Match"] = state["etag"]
+    if state.get("last_modified"):
+        headers["If-Modified-Since"] = state["last_modified"]
+    return headers
+
+
+def content_digest(content):
+    return hashlib.sha1(content).hexdigest()
+
+
+def mark_unchanged(rss_dir):
+    """源没有更新：保留目录，但是不留new.csv，后面的步骤看到没有new.csv就跳过"""
+    os.makedirs(rss_dir, exist_ok=True)
+    drop_frame(rss_dir + "new.csv")
+
+
+def normalize_entries(rp, r, state):
+    """把feedparser的条目转成rss_link，跳过比已知最新条目更旧的条目
+
+    只有确认过这个源是按时间倒序输出的，遇到旧条目才直接停下，否则逐条过滤
+    """
+    newest = state.get("newest", 0)
+    # 时间在未来的条目不能作为依据，不然之后的条目都会被丢掉
+    if newest > time.time():
+        newest = 0
+    newest_link = state.get("newest_link")
+    descending = state.get("descending", False)
+    rss_link = []
+    timestamps = []
+    for et in rp["entries"]:
+        entry_date = get_entry_date(et)
+        timestamp = time.mktime(entry_date)
+        if timestamp < newest or et["link"] == newest_link:
+            if descending:
+                break
+            timestamps.append(timestamp)
+            continue
+        timestamps.append(timestamp)
+        rss_link.append(
+            {
+                "title": et["title"].replace(",", "，"),
+                # 如果源相同, 但是author名字不同, 这里就会使用最后一个
+                "author": (
+                    rp["feed"]["link"]
+                    if "title" not in rp["feed"].keys()
+                    else rp["feed"]["title"]
+                ),
+                "link": et["link"],
+                "home": rp["feed"]["link"],
+                "rss": r,
+                "date": time.strftime("%Y-%m-%d", entry_date),
+                "timestamp": timestamp,
+            }
+        )
+    else:
+        # 完整看过所有条目时，记下这个源是不是按时间倒序输出
+        state["descending"] = all(a >= b for a, b in zip(timestamps, timestamps[1:]))
+    return rss_link
+
+
+def is_due(state, now):
+    return state.get("due", 0) <= now + SCHEDULE_SLACK
+
+
+def schedule_next(state, now, failed=False, timestamps=[]):
+    """根据最近的发布间隔、沉寂时间和连续失败次数，算出下一次抓取的时间
+
+    timestamps只有这次新抓到的条目，新的发布间隔从已知最新的一条接着算，放在已有间隔的前面
+    """
+    if timestamps:
+        newest = state.get("newest", 0)
+        ts = sorted({t for t in timestamps if t > newest}, reverse=True)
+        if ts and newest:
+            ts.append(newest)
+        intervals = [a - b for a, b in zip(ts, ts[1:])]
+        state["intervals"] = (intervals + state.get("intervals", []))[:SCHEDULE_INTERVALS]
+        state["newest"] = max(ts[0] if ts else 0, newest)
+    state["failures"] = state.get("failures", 0) + 1 if failed else 0
+    state["checked"] = now
+
+    intervals = sorted(state.get("intervals", []))
+    estimate = intervals[len(intervals) // 2] if intervals else 0
+    # 很久没有更新的博客，按照沉寂的时间退避
+    if state.get("newest"):
+        estimate = max(estimate, now - state["newest"])
+    delay = estimate / SCHEDULE_RATIO
+    if state["failures"] > 0:
+        delay = max(delay, SCHEDULE_FAILURE_BASE * 2 ** (state["failures"] - 1))
+    state["due"] = now + min(SCHEDULE_MAX, max(0, delay))
+
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def dump_report(report_path, records):
+    """每个源的抓取耗时、大小、结果，加上汇总，用来找出拖慢抓取的源"""
+
+    def total(r):
+        return r["elapsed"] + r["download"] + r["parse"]
+
+    fetched = [r for r in records if r["status"] != "not due"]
+    status = {}
+    for r in records:
+        status[r["status"]] = status.get(r["status"], 0) + 1
+    summary = {
+        "feeds": len(records),
+        "fetched": len(fetched),
+        "status": status,
+        "bytes": sum(r["bytes"] for r in fetched),
+        "entries": sum(r["entries"] for r in fetched),
+        "p50": percentile([total(r) for r in fetched], 50),
+        "p95": percentile([total(r) for r in fetched], 95),
+        "parse_p50": percentile([r["parse"] for r in fetched], 50),
+        "parse_p95": percentile([r["parse"] for r in fetched], 95),
+        "slowest": [r["rss"] for r in sorted(fetched, key=total, reverse=True)[:REPORT_TOP]],
+    }
+    print(
+        "fetch report: %d feeds, %d fetched, p50 %.2fs, p95 %.2fs, %s"
+        % (len(records), len(fetched), summary["p50"], summary["p95"], status)
+    )
+    os.makedirs(os.path.dirname(report_path), exist_ok=True)
+    with open(report_path, "w") as f:
+        json.dump(
+            {
+                "time": time.time(),
+                "summary": summary,
+                "feeds": sorted(records, key=lambda r: r["rss"]),
+            },
+            f,
+            indent=2,
+        )
+
+
+def get_host(url):
+    return urlparse(url).netloc.lower()
+
+
+def interleave_host(rss, host=get_host):
+    """按host轮流排列，避免同一个host的源挤在一起占满worker；host从每一项取出它的host"""
+    hosts = {}
+    for r in rss:
+        hosts.setdefault(host(r), []).append(r)
+    queues = list(hosts.values())
+    ordered = []
+    for i in range(max([len(q) for q in queues], default=0)):
+        ordered += [q[i] for q in queues if i < len(q)]
+    return ordered
+
+
+def fetch_source(
+    rss_fetch_source_dir,
+    rss,
+    rss_state=None,
+    workers=FETCH_WORKERS,
+    host_workers=FETCH_HOST_WORKERS,
+    full=False,
+    report=None,
+    rss_legacy_dir=None,
+):
+    """按照来源抓取rss，放到每个源对应的new.csv中
+
+    rss_state文件中保存所有源的ETag/Last-Modified、内容摘要和调度信息，服务器返回304、
+    内容没变或者还没到抓取时间时，不再解析，也不写new.csv，上一次的解析结果已经合并在
+    public/source/<md5>/中了；full为True时忽略调度，抓取所有的源；report不为空时，
+    把每个源的抓取耗时等信息写到这个文件；rss_legacy_dir见load_states
+    """
     print("fetch new rss ...")
     if not os.path.isdir(rss_fetch_source_dir):
         os.makedirs(rss_fetch_source_dir)
+    states = load_states(rss_state, rss_legacy_dir) if rss_state else {}
 
-    def parse_rss(r):
+    def parse_rss(r, rss_dir, state, record):
+        """返回抓取结果和条目的时间戳，耗时等信息记录到record中"""
         try:
-            content = requests.get(r, timeout=10.0).content
+            start = time.time()
+            resp = http_get(r, headers=conditional_headers(state), stream=True)
+            # elapsed是收到响应头的时间，包括DNS、建立连接和服务器处理
+            record["elapsed"] = resp.elapsed.total_seconds()
+            record["http_status"] = resp.status_code
+            if resp.status_code == 304:
+                resp.close()
+                print("parse", r, "not modified")
+                mark_unchanged(rss_dir)
+                return "not modified", []
+            try:
+                content, truncated = read_limited(resp, FETCH_MAX_BYTES)
+            finally:
+                resp.close()
+            if truncated:
+                print("parse", r, "truncated to", FETCH_MAX_BYTES, "bytes")
+                record["truncated"] = True
+            record["download"] = max(0, time.time() - start - record["elapsed"])
+            record["bytes"] = len(content)
+            digest = content_digest(content)
+            # 很多服务器不支持条件请求，每次都返回一样的内容
+            if digest == state.get("digest"):
+                print("parse", r, "unchanged")
+                mark_unchanged(rss_dir)
+                return "unchanged", []
+            start = time.time()
             rp = feedparser.parse(BytesIO(content))
+            record["parse"] = time.time() - start
         except Exception as e:
             print("parse", r, "error", e)
-            return
+            # 超时之类的失败也要算上耗时，这些源最拖慢抓取
+            record["elapsed"] = record["elapsed"] or time.time() - start
+            record["error"] = type(e).__name__
+            return "error", []
 
         print("parse", r)
         try:
-            rss_link = [
-                {
-                    "title": et["title"].replace(",", "，"),
-                    # 如果源相同, 但是author名字不同, 这里就会使用最后一个
-                    "author": (
-                        rp["feed"]["link"]
-                        if "title" not in rp["feed"].keys()
-                        else rp["feed"]["title"]
-                    ),
-                    "link": et["link"],
-                    "home": rp["feed"]["link"],
-                    "rss": r,
-                    "date": time.strftime("%Y-%m-%d", get_entry_date(et)),
-                    "timestamp": time.mktime(get_entry_date(et)),
-                }
-                for et in rp["entries"]
-            ]
+            rss_link = normalize_entries(rp, r, state)
         except Exception as e:
             print("un-support rss", r, e)
-            return
+            record["error"] = type(e).__name__
+            return "un-support", []
 
-        url_hash = hash_url(r)
-        rss_dir = rss_fetch_source_dir + url_hash + "/"
         # 不管能不能获取到，先创建一个目录
         # 好处是保证完整性，不管怎么样都有所有的source
         # 坏处是，后续merge操作可能需要判断路径空
-        if not os.path.isdir(rss_dir):
-            os.makedirs(rss_dir)
+        os.makedirs(rss_dir, exist_ok=True)
 
+        state.update(
+            {
+                "etag": resp.headers.get("ETag"),
+                "last_modified": resp.headers.get("Last-Modified"),
+                "digest": digest,
+            }
+        )
         df = pandas.json_normalize(rss_link)
         if len(df) <= 0:
-            print("fetching skip", r, "to", url_hash, "size", len(rss_link), len(df))
-            return
-        df.to_csv(rss_dir + "new.csv", index=False, sep=",", encoding="utf-8")
+            print("fetching skip", r, "to", hash_url(r), "size", len(rss_link), len(df))
+            mark_unchanged(rss_dir)
+            return "empty", []
+        put_frame(rss_dir + "new.csv", df)
+        record["entries"] = len(df)
+        newest = max(rss_link, key=lambda link: link["timestamp"])
+        if newest["timestamp"] >= state.get("newest", 0):
+            state["newest_link"] = newest["link"]
+        return "updated", [link["timestamp"] for link in rss_link]
 
-    # pool = ThreadPoolExecutor(max_workers=10)
-    # futures = []
-    # for r in rss:
-    #     futures.append(pool.submit(parse_rss, r))
+    def fetch_rss(r):
+        url_hash = hash_url(r)
+        rss_dir = rss_fetch_source_dir + url_hash + "/"
+        record = {
+            "rss": r,
+            "host": get_host(r),
+            "status": "not due",
+            "http_status": None,
+            "elapsed": 0,
+            "download": 0,
+            "parse": 0,
+            "bytes": 0,
+            "entries": 0,
+            "error": None,
+            "truncated": False,
+        }
+        # 每个源只改自己的state，最后一起写
+        state = states.setdefault(url_hash, {})
+        now = time.time()
+        if rss_state and not full and not is_due(state, now):
+            print("parse", r, "not due")
+            mark_unchanged(rss_dir)
+            return record
+        status, timestamps = parse_rss(r, rss_dir, state, record)
+        record["status"] = status
+        if rss_state:
+            state["rss"] = r
+            schedule_next(state, now, status in {"error", "un-support"}, timestamps)
+        return record
 
-    # for future in futures:
-    #     future.result()
+    # 每个源只写自己的目录，线程之间不共享结果，不需要额外加锁
+    host_limits = {host: threading.Semaphore(host_workers) for host in map(get_host, rss)}
 
-    for r in rss:
-        parse_rss(r)
+    def fetch_rss_limited(r):
+        with host_limits[get_host(r)]:
+            return fetch_rss(r)
+
+    records = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(fetch_rss_limited, r): r for r in interleave_host(rss)}
+        for future in as_completed(futures):
+            try:
+                records.append(future.result())
+            except Exception as e:
+                print("parse", futures[future], "error", e)
+
+    if rss_state:
+        # 已经不在订阅列表里的源不再保留
+        dump_states(rss_state, {hash_url(r): states[hash_url(r)] for r in rss if hash_url(r) in states})
+    if report:
+        dump_report(report, records)
 
     print("fetch new rss done")
 
@@ -100,95 +402,140 @@ def combine_source(rss_fetch_all_dir, rss_fetch_source_dir):
     dfs = []
     for file in source_dirs:
         source_file_path = rss_fetch_source_dir + file + "/new.csv"
-        if not os.path.isfile(source_file_path):
+        if not has_frame(source_file_path):
             continue
         try:
-            df = pandas.read_csv(source_file_path, encoding="utf-8")
+            df = read_frame(source_file_path)
             dfs.append(df)
         except:
             print("combining skip", file)
-    df = pandas.concat(dfs)
+    # 所有源都没有更新时（比如都返回304），也要写一个空的new.csv
+    df = pandas.concat(dfs) if dfs else empty_frame()
     df = df.sort_values("timestamp", ascending=False)
-    df.to_csv(rss_fetch_all_dir + "new.csv", index=False, sep=",", encoding="utf-8")
+    put_frame(rss_fetch_all_dir + "new.csv", df)
     print("combin all page done")
 
 
+def member_frame(df):
+    """按author去重，每个author保留最新的一条"""
+    df = df.sort_values(by="author", kind="mergesort")  # 保留前后顺序
+    df = df.drop_duplicates(subset=["author"], keep="first")
+    return df.sort_values(by="timestamp", ascending=False)
+
+
 def combine_member(rss_fetch_member_dir, rss_fetch_all_dir):
     """通过all/new.csv中的author去重，得到member/new.csv，这里面包含了所有的author（更新了的）"""
     print("combin member rss ...")
     if not os.path.isdir(rss_fetch_member_dir):
         os.makedirs(rss_fetch_member_dir)
-    df = pandas.read_csv(rss_fetch_all_dir + "/new.csv", encoding="utf-8")
-    df = df.sort_values(by="author", kind="mergesort")  # 保留前后顺序
-    df = df.drop_duplicates(subset=["author"], keep="first")
-    df = df.sort_values(by="timestamp", ascending=False)
-    df.to_csv(rss_fetch_member_dir + "new.csv", index=False, sep=",", encoding="utf-8")
+    df = read_frame(rss_fetch_all_dir + "/new.csv")
+    put_frame(rss_fetch_member_dir + "new.csv", member_frame(df))
     print("combin member rss done")
 
 
-def split_date(rss_fetch_date_dir, rss_fetch_all_dir):
-    """按照年月分类，把all/new.csv中的数据按照年月分类，放到date/年月/new.csv中"""
-    print("split date page ...")
-    if not os.path.isdir(rss_fetch_date_dir):
-        os.makedirs(rss_fetch_date_dir)
-    df = pandas.read_csv(rss_fetch_all_dir + "/new.csv", encoding="utf-8")
-    dfd = {}
-    for i, d in df.iterrows():
-        # Validate date format before slicing
-        date_str = str(d["date"])
-        if len(date_str) < 10 or date_str[4] != "-" or date_str[7] != "-":
-            print(f"Warning: Invalid date format '{date_str}' at row {i}, skipping")
-            continue
-        # Extract year and month directly
-        year_str = date_str[0:4]
-        month_str = date_str[5:7]
-        # Validate year and month are numeric and reasonable
+def parse_int(values):
+    """和int()的规则一致，不能转换的为None；只对不重复的值调用int()"""
+    lookup = {}
+    for v in values.unique():
         try:
-            year = int(year_str)
-            month = int(month_str)
-            if year < 1970 or year > 2100 or month < 1 or month > 12:
-                print(f"Warning: Invalid year/month '{year_str}-{month_str}' from date '{date_str}' at row {i}, skipping")
-                continue
+            lookup[v] = int(v)
         except ValueError:
-            print(f"Warning: Non-numeric year/month '{year_str}-{month_str}' from date '{date_str}' at row {i}, skipping")
-            continue
-        year_month = year_str + month_str
-        if year_month not in dfd.keys():
-            dfd[year_month] = []
-        dfd[year_month].append(i)
-    for key, i in dfd.items():
+            lookup[v] = None
+    return values.map(lookup)
+
+
+def year_month(df):
+    """按列校验date并得到年月（YYYYMM），不合法的行为None，规则和逐行校验时一致"""
+    date = df["date"].astype(str).reset_index(drop=True)
+    # Validate date format before slicing
+    formatted = (date.str.len() >= 10) & (date.str[4] == "-") & (date.str[7] == "-")
+    # Extract year and month directly
+    year_str = date.str[0:4]
+    month_str = date.str[5:7]
+    year = parse_int(year_str)
+    month = parse_int(month_str)
+    numeric = year.notna() & month.notna()
+    ranged = numeric & (year >= 1970) & (year <= 2100) & (month >= 1) & (month <= 12)
+    valid = formatted & ranged
+    # 不合法的行一般很少，逐行打印原因
+    for i in (~valid).to_numpy().nonzero()[0]:
+        if not formatted[i]:
+            print(f"Warning: Invalid date format '{date[i]}' at row {i}, skipping")
+        elif not numeric[i]:
+            print(f"Warning: Non-numeric year/month '{year_str[i]}-{month_str[i]}' from date '{date[i]}' at row {i}, skipping")
+        else:
+            print(f"Warning: Invalid year/month '{year_str[i]}-{month_str[i]}' from date '{date[i]}' at row {i}, skipping")
+    ym = (year_str + month_str).where(valid, None)
+    ym.index = df.index
+    return ym
+
+
+def put_date_frames(rss_fetch_date_dir, df, ym):
+    """按照年月分区，每个分区只写一次"""
+    for key, part in df.groupby(ym, sort=False):
         date_dir = rss_fetch_date_dir + key
         if not os.path.isdir(date_dir):
             os.makedirs(date_dir)
-        df.iloc[i].to_csv(date_dir + "/new.csv", index=False, sep=",", encoding="utf-8")
+        put_frame(date_dir + "/new.csv", part)
+
+
+def split_date(rss_fetch_date_dir, rss_fetch_all_dir):
+    """按照年月分类，把all/new.csv中的数据按照年月分类，放到date/年月/new.csv中"""
+    print("split date page ...")
+    if not os.path.isdir(rss_fetch_date_dir):
+        os.makedirs(rss_fetch_date_dir)
+    df = read_frame(rss_fetch_all_dir + "/new.csv")
+    put_date_frames(rss_fetch_date_dir, df, year_month(df))
     print("split date page done")
 
 
-def split_user(rss_fetch_user_dir, rss_user, rss_fetch_source_dir):
-    """按照用户分类，把all/new.csv中的数据按照用户分类，每个用户下又有date、member、all目录"""
+def split_user(
+    rss_fetch_user_dir, rss_user, rss_fetch_source_dir, rss_out_source_dir=None, rss_user_prev={}
+):
+    """按照用户分类，把all/new.csv中的数据按照用户分类，每个用户下又有date、member、all目录
+
+    所有用户的数据拼成一张表，只排序、校验日期一次，再按用户分区；
+    new.csv里只有这个源比已知最新的更新的条目，所以用户新订阅的源不管有没有new.csv，
+    都从rss_out_source_dir中已经合并好的最新一页补上
+    """
     print("combin user rss ...")
     if not os.path.isdir(rss_fetch_user_dir):
         os.makedirs(rss_fetch_user_dir)
+    dfs = []
     for user, user_rss in rss_user.items():
-        dfs = []
+        subscribed = set(rss_user_prev.get(user, []))
         for r in user_rss:
             url_hash = hash_url(r)
-            # 每个源一定有一个source
+            # 每个源一定有一个source，没有new.csv说明这个源没有更新
+            source_file_path = rss_fetch_source_dir + url_hash + "/new.csv"
             try:
-                ldf = pandas.read_csv(
-                    rss_fetch_source_dir + url_hash + "/new.csv", encoding="utf-8"
-                )
-                dfs.append(ldf)
+                if has_frame(source_file_path):
+                    dfs.append(read_frame(source_file_path).assign(user=user))
+                if rss_out_source_dir and r not in subscribed:
+                    out = rss_out_source_dir + url_hash + "/"
+                    # public下的分页merge时会重写，不放进缓存
+                    if page_count(out) > 0:
+                        dfs.append(read_newest(out, SUBSCRIBE_ROWS).assign(user=user))
             except:
                 print("combin user skip", url_hash)
-        df = pandas.concat(dfs)
-        df = df.sort_values("timestamp", ascending=False)
+    df = pandas.concat(dfs, ignore_index=True) if dfs else empty_frame().assign(user=None)
+    df = df.sort_values("timestamp", ascending=False, kind="mergesort")
+    # 新订阅的源补上的数据可能和new.csv重复
+    df = df.drop_duplicates(subset=["user", "link"], keep="first")
+    ym = year_month(df)
+    users = {user: part for user, part in df.groupby("user", sort=False)}
+    for user in rss_user.keys():
+        udf = users[user].drop(columns="user") if user in users else empty_frame()
         rss_dir = rss_fetch_user_dir + user + "/all/"
         if not os.path.isdir(rss_dir):
             os.makedirs(rss_dir)
-        df.to_csv(rss_dir + "new.csv", index=False, sep=",", encoding="utf-8")
+        put_frame(rss_dir + "new.csv", udf)
         date_dir = rss_fetch_user_dir + user + "/date/"
-        split_date(date_dir, rss_dir)  # user date
+        if not os.path.isdir(date_dir):
+            os.makedirs(date_dir)
+        put_date_frames(date_dir, udf, ym[udf.index])  # user date
         member_dir = rss_fetch_user_dir + user + "/member/"
-        combine_member(member_dir, rss_dir)  # user member
+        if not os.path.isdir(member_dir):
+            os.makedirs(member_dir)
+        put_frame(member_dir + "new.csv", member_frame(udf))  # user member
     print("combin user rss done")
@@ -1,5 +1,6 @@
 import os, sys
 import pandas, hashlib
+from store_utils import remove_history
 
 
 def hash_url(url):
@@ -44,6 +45,8 @@ def fix_source():
         source = source.drop_duplicates(subset=["link"], keep="first")
         source = source.sort_values(by="timestamp", ascending=False)
         source.to_csv(source_path, index=False, sep=",", encoding="utf-8")
+        # 1.csv改过了，source的parquet历史不再可信
+        remove_history(os.path.join(source_dir, sdir, ""))
         print("fixing source", sdir, "done")
 
 fix_map = {
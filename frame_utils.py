@@ -0,0 +1,88 @@
+# coding=UTF-8
+
+import os
+import threading
+import pandas
+from collections import OrderedDict
+
+# 各个阶段之间传递的new.csv，按路径保存在内存里，后面的阶段不用再从磁盘读；
+# 源的路径里带着url的hash，所以源的frame也是按hash缓存的，多个用户订阅同一个源时只读一次
+FRAMES = OrderedDict()
+# 每个frame占用的内存
+FRAME_SIZES = {}
+# 只在内存里、还没有写到磁盘的frame
+FRAME_DIRTY = set()
+# 缓存的内存上限，超过后淘汰最久没用的frame；只在内存里的frame淘汰前先写到磁盘
+FRAME_BUDGET = 1024 * 1024 * 1024
+# 是否同时写到磁盘；单独运行fetch时merge在另一个进程里，需要写盘，
+# fetch和merge在同一个进程里时可以关掉，__tmp__下就不会再写new.csv
+WRITE_THROUGH = True
+
+# fetch时多个线程同时写
+_lock = threading.RLock()
+
+
+def frame_key(path):
+    return os.path.normpath(path)
+
+
+def write_csv(path, df):
+    df.to_csv(path, index=False, sep=",", encoding="utf-8")
+
+
+def evict():
+    """超过内存上限时，按最久没用的顺序淘汰"""
+    total = sum(FRAME_SIZES.values())
+    while total > FRAME_BUDGET and len(FRAMES) > 1:
+        key, df = FRAMES.popitem(last=False)
+        total -= FRAME_SIZES.pop(key)
+        if key in FRAME_DIRTY:
+            FRAME_DIRTY.discard(key)
+            write_csv(key, df)
+
+
+def cache_frame(key, df, dirty):
+    FRAMES[key] = df
+    FRAMES.move_to_end(key)
+    FRAME_SIZES[key] = int(df.memory_usage(index=True, deep=True).sum())
+    if dirty:
+        FRAME_DIRTY.add(key)
+    else:
+        FRAME_DIRTY.discard(key)
+    evict()
+
+
+def put_frame(path, df):
+    with _lock:
+        if WRITE_THROUGH:
+            write_csv(path, df)
+        cache_frame(frame_key(path), df, not WRITE_THROUGH)
+
+
+def has_frame(path):
+    with _lock:
+        return frame_key(path) in FRAMES or os.path.isfile(path)
+
+
+def read_frame(path):
+    """优先从内存里取，没有的话读磁盘并缓存，都没有返回None"""
+    key = frame_key(path)
+    with _lock:
+        if key in FRAMES:
+            FRAMES.move_to_end(key)
+            return FRAMES[key]
+        if not os.path.isfile(path):
+            return None
+        df = pandas.read_csv(path, encoding="utf-8")
+        cache_frame(key, df, False)
+        return df
+
+
+def drop_frame(path):
+    key = frame_key(path)
+    with _lock:
+        FRAMES.pop(key, None)
+        FRAME_SIZES.pop(key, None)
+        FRAME_DIRTY.discard(key)
+        if os.path.isfile(path):
+            os.remove(path)
@@ -0,0 +1,64 @@
+# coding=UTF-8
+
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# (连接超时, 读超时)
+HTTP_TIMEOUT = (5.0, 10.0)
+# 失败重试次数，只重试连接失败和服务端临时错误
+HTTP_RETRIES = 2
+HTTP_RETRY_BACKOFF = 0.5
+HTTP_RETRY_STATUS = (429, 500, 502, 503, 504)
+# 保留多少个host的连接池
+HTTP_POOL_HOSTS = 256
+# 每个host保留多少个keep-alive连接
+HTTP_POOL_SIZE = 4
+HTTP_USER_AGENT = "Mozilla/5.0 (compatible; RSSBlog; +https://rssblog.cn/)"
+# 流式读取时每次读多少字节
+HTTP_CHUNK = 64 * 1024
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """所有抓取共用一个session，同一个host复用连接，省掉重复的TLS握手"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=HTTP_RETRIES,
+                backoff_factor=HTTP_RETRY_BACKOFF,
+                status_forcelist=HTTP_RETRY_STATUS,
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(
+                pool_connections=HTTP_POOL_HOSTS,
+                pool_maxsize=HTTP_POOL_SIZE,
+                max_retries=retry,
+            )
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers["User-Agent"] = HTTP_USER_AGENT
+            _session = session
+    return _session
+
+
+def http_get(url, **kwargs):
+    kwargs.setdefault("timeout", HTTP_TIMEOUT)
+    return get_session().get(url, **kwargs)
+
+
+def read_limited(resp, limit):
+    """流式读取响应，超过limit字节就不再读，返回内容和是否被截断"""
+    chunks = []
+    size = 0
+    for chunk in resp.iter_content(HTTP_CHUNK):
+        chunks.append(chunk)
+        size += len(chunk)
+        if size > limit:
+            return b"".join(chunks)[:limit], True
+    return b"".join(chunks), False
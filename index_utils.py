@@ -0,0 +1,94 @@
+# coding=UTF-8
+# 稳定分页下每个分区的去重索引：排好序的uint64 hash，用np.load(mmap_mode="r")直接映射，
+# 判断新数据是否已经出现过时不用再读分区所有的分页
+
+import io
+import os
+import numpy
+import pandas
+from output_utils import write_output, remove_output
+
+# link的hash
+INDEX_LINK = "links.npy"
+# (home, timestamp)的hash
+INDEX_KEY = "keys.npy"
+# duplicate_set里字段的hash，member分区是home
+INDEX_DUP = "dups.npy"
+INDEX_FILES = (INDEX_LINK, INDEX_KEY, INDEX_DUP)
+
+
+def hash_columns(df, columns):
+    """按行对columns做64位hash，timestamp统一成float，csv读出来的类型不一样时hash也一样"""
+    df = df[list(columns)]
+    if "timestamp" in df.columns:
+        df = df.assign(timestamp=df["timestamp"].astype("float64"))
+    return pandas.util.hash_pandas_object(df, index=False).to_numpy(dtype=numpy.uint64)
+
+
+def index_hashes(df, duplicate_set=set()):
+    """返回每个索引文件对应的hash"""
+    hashes = {
+        INDEX_LINK: hash_columns(df, ["link"]),
+        INDEX_KEY: hash_columns(df, ["home", "timestamp"]),
+    }
+    if duplicate_set:
+        hashes[INDEX_DUP] = hash_columns(df, sorted(duplicate_set))
+    return hashes
+
+
+def index_names(duplicate_set=set()):
+    return (INDEX_LINK, INDEX_KEY, INDEX_DUP) if duplicate_set else (INDEX_LINK, INDEX_KEY)
+
+
+def has_index(out, duplicate_set=set()):
+    return all(os.path.isfile(out + name) for name in index_names(duplicate_set))
+
+
+def load_index(out, duplicate_set=set()):
+    """只读映射，没有的时候返回空数组"""
+    index = {}
+    for name in index_names(duplicate_set):
+        if os.path.isfile(out + name):
+            index[name] = numpy.load(out + name, mmap_mode="r")
+        else:
+            index[name] = numpy.empty(0, dtype=numpy.uint64)
+    return index
+
+
+def contains(index, hashes):
+    """hashes中每个值是否在排好序的index中"""
+    if len(index) == 0:
+        return numpy.zeros(len(hashes), dtype=bool)
+    pos = numpy.searchsorted(index, hashes)
+    pos[pos >= len(index)] = 0
+    return index[pos] == hashes
+
+
+def is_indexed(out, df, duplicate_set=set()):
+    """df中已经在索引里的行"""
+    index = load_index(out, duplicate_set)
+    known = numpy.zeros(len(df), dtype=bool)
+    for name, hashes in index_hashes(df, duplicate_set).items():
+        known |= contains(index[name], hashes)
+    return known
+
+
+def dump_index(out, index):
+    for name, hashes in index.items():
+        buf = io.BytesIO()
+        numpy.save(buf, numpy.ascontiguousarray(hashes, dtype=numpy.uint64))
+        write_output(out + name, buf.getvalue())
+
+
+def add_index(out, df, duplicate_set=set(), rebuild=False):
+    """把df的hash并到索引里；rebuild时丢掉已有的索引"""
+    index = {} if rebuild else load_index(out, duplicate_set)
+    merged = {}
+    for name, hashes in index_hashes(df, duplicate_set).items():
+        merged[name] = numpy.union1d(index.get(name, hashes[:0]), hashes)
+    dump_index(out, merged)
+
+
+def remove_index(out):
+    for name in INDEX_FILES:
+        remove_output(out + name)
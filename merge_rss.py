@@ -1,33 +1,56 @@
-from fetch_rss import (
+from config import (
     rss_fetch_source_dir,
     rss_fetch_member_dir,
     rss_fetch_user_dir,
     rss_fetch_all_dir,
     rss_fetch_date_dir,
+    rss_out_source_dir,
+    rss_out_member_dir,
+    rss_out_user_dir,
+    rss_out_all_dir,
+    rss_out_date_dir,
+    rss_out_stats_dir,
+    rss_out_base_url,
+    rss_out_manifest,
+    rss_out_page_exports,
+    rss_out_search_dir,
 )
+import page_utils
+import feed_utils
+import os
 from merge_utils import *
-import json
-
-rss_out_source_dir = "./public/source/"
-rss_out_member_dir = "./public/member/"
-rss_out_user_dir = "./public/user/"
-rss_out_all_dir = "./public/all/"
-rss_out_date_dir = "./public/date/"
-rss_out_stats_dir = "./public/"
-
+from output_utils import load_manifest, dump_manifest, write_json, report
+from search_utils import update_search
+from frame_utils import read_frame
 
 def merge():
+    load_manifest(rss_out_manifest)
+    page_utils.PAGE_EXPORTS = rss_out_page_exports
+    feed_utils.FEED_ROOT = rss_out_stats_dir
+    feed_utils.FEED_BASE = rss_out_base_url
     merge_source(rss_out_source_dir, rss_fetch_source_dir)
     merge_all(rss_out_all_dir, rss_fetch_all_dir)
     merge_member(rss_out_member_dir, rss_fetch_member_dir)
     merge_date(rss_out_date_dir, rss_fetch_date_dir)
     merge_user(rss_out_user_dir, rss_fetch_user_dir)
+    update_search(rss_out_search_dir, rss_out_all_dir, read_frame(rss_fetch_all_dir + "new.csv"))
+    # member等分区不跟随PAGE_LAYOUT，分页方式和layout不同的分区列在layouts中
+    layouts = {}
+    for out, layout in LAYOUTS.items():
+        if layout != PAGE_LAYOUT:
+            layouts[os.path.relpath(out, rss_out_stats_dir).replace(os.sep, "/")] = layout
     dumps = {
         "batch": SPLIT,
+        "layout": PAGE_LAYOUT,
+        "layouts": layouts,
         "urls": URL,
     }
+    # stats.min.json保持原来的结构；stats.json再加上每一页的行数、时间范围和hash，客户端只需要下载变了的分页
+    pages = {}
+    for out, stats in PAGES.items():
+        pages[os.path.relpath(out, rss_out_stats_dir).replace(os.sep, "/")] = stats
     # 最终结果
-    with open(rss_out_stats_dir + "stats.json", "w") as f:
-        json.dump(dumps, f, indent=2)
-    with open(rss_out_stats_dir + "stats.min.json", "w") as f:
-        json.dump(dumps, f)
+    write_json(rss_out_stats_dir + "stats.json", dict(dumps, page_fields=PAGE_FIELDS, pages=pages), indent=2)
+    write_json(rss_out_stats_dir + "stats.min.json", dumps)
+    dump_manifest(rss_out_manifest)
+    print("merge output:", report())
@@ -1,100 +1,196 @@
 # coding=UTF-8
 
 import os
-import json
 import time
-import requests
-import feedparser
 import pandas
 import hashlib
 import math
-import datetime
-import PyRSS2Gen
+from concurrent.futures import ProcessPoolExecutor
+from frame_utils import has_frame, read_frame
+from page_utils import *
+from output_utils import take_updates, apply_updates
+from index_utils import has_index, is_indexed, add_index, remove_index
+from store_utils import read_history, write_history, remove_history
+from stream_utils import stream_merge
+from feed_utils import has_feeds, write_feeds
 
 SPLIT = 50
 URL = {}
+# 每个分区每一页的统计，key是分区的目录，见page_utils.PAGE_FIELDS
+PAGES = {}
+# 每个分区的分页方式，key是分区的目录
+LAYOUTS = {}
+# 并行merge的进程数，1表示串行
+MERGE_WORKERS = os.cpu_count() or 1
+# 每个用户下的分区，顺序决定stats中的顺序
+USER_PARTITION = ("all", "date", "member")
+# 分页方式，LAYOUT_CUT或者LAYOUT_STABLE，见page_utils；
+# 有duplicate_set的分区（member）要用新的一条替换旧的，始终用cut分页
+PAGE_LAYOUT = LAYOUT_CUT
+# cut分页的分区达到这么多页时改用流式合并，只有去重用的hash随分区大小增长，0表示不用
+MERGE_STREAM_PAGES = 20000
 
 
 def cut(out, df, batch):
     size = len(df)
     starts = [s for s in range(0, size, batch)]
     for idx, start in enumerate(starts):
-        batch_file = out + str(idx + 1) + ".csv"
         df_batch = df[start : start + batch]
-        df_batch.to_csv(batch_file, index=False, sep=",", encoding="utf-8")
+        write_page(out, idx + 1, df_batch)
 
     batch_num = math.ceil(size / batch)
+    remove_pages(out, batch_num + 1)
+    finish_pages(out, LAYOUT_CUT, batch_num)
+    # 去重索引只在稳定分页下维护，切回cut后就过期了
+    remove_index(out)
     return batch_num
 
 
+def cut_stable(out, df, batch, start_page):
+    """稳定分页：df按时间从新到旧，从start_page开始按从旧到新的顺序写满每一页"""
+    df = df[::-1]
+    size = len(df)
+    for idx, start in enumerate(range(0, size, batch)):
+        write_page(out, start_page + idx, df[start : start + batch][::-1])
+    batch_num = start_page - 1 + math.ceil(size / batch)
+    remove_pages(out, batch_num + 1)
+    finish_pages(out, LAYOUT_STABLE, batch_num)
+    # 稳定分页只改最后几页，不再维护完整的历史文件
+    remove_history(out)
+    return batch_num
+
+
+def dedupe(df, duplicate_set=set()):
+    # 先排序
+    df = df.sort_values(by="timestamp", ascending=False)
+    # 所有的链接肯定不要重复
+    df = df.drop_duplicates(subset=["link"], keep="first")
+    # 发现有人用localhost，肯定不行啦，这样处理有点暴力
+    df = df[~df["link"].str.contains("localhost") | df["link"].str.contains("127.0.0.1")]
+    # 同一个home，同一个timestamp，只保留一个
+    df = df.drop_duplicates(subset=["home", "timestamp"], keep="first")
+    if duplicate_set:
+        df = df.drop_duplicates(subset=list(duplicate_set), keep="first")
+    return df
+
+
+def read_keys(out, pages, duplicate_set=set()):
+    """读取分页中用来去重的列"""
+    columns = sorted({"link", "home", "timestamp"} | set(duplicate_set))
+    dfs = [read_page(out, idx, columns) for idx in pages]
+    return pandas.concat(dfs) if dfs else None
+
+
+def append_frame(out, df, duplicate_set=set()):
+    """稳定分页下合并：只重写最后一页和新增的分页
+
+    已经写满的分页不会再变，新数据里已经出现过的链接直接丢掉，不会像cut那样用更新的时间替换旧的
+    """
+    batch_num = page_count(out)
+    if layout_of(out) != LAYOUT_STABLE:
+        # 第一次切到稳定分页，把已有的分页按从旧到新重排一次，同时建好去重索引
+        df = dedupe(pandas.concat([df, read_history(out)]), duplicate_set)
+        add_index(out, df, duplicate_set, rebuild=True)
+        return cut_stable(out, df, SPLIT, 1)
+    if not has_index(out, duplicate_set):
+        # 没有索引的稳定分区，从已有分页的去重列补建一次
+        keys = read_keys(out, range(1, batch_num + 1), duplicate_set)
+        add_index(out, df[:0] if keys is None else keys, duplicate_set, rebuild=True)
+
+    # 用索引判断哪些是新数据，不用读已有的分页
+    df = dedupe(df, duplicate_set)
+    df = df[~is_indexed(out, df, duplicate_set)]
+    if len(df) <= 0:
+        return batch_num
+    head = read_page(out, batch_num) if batch_num > 0 else df[:0]
+    merged = dedupe(pandas.concat([head, df]), duplicate_set)
+    add_index(out, df, duplicate_set)
+    return cut_stable(out, merged, SPLIT, max(batch_num, 1))
+
+
 def merge(out, fetch, duplicate_set=set()):
     """fetch合并到out，fetch和out都是目录，dupset是去重的字段"""
-    dfs = []
-    # fetch可能拿不到数据，但是也会创建对应的目录，所以需要判断是否存在
-    if os.path.exists(fetch + "new.csv"):
-        df = pandas.read_csv(fetch + "new.csv", encoding="utf-8")
-        dfs.append(df)
+    df = read_frame(fetch + "new.csv")
+    batch_num = merge_frame(out, df, duplicate_set)
+    update_feeds(out, batch_num, df is not None and len(df) > 0)
+    record_pages(out)
+    return batch_num
+
+
+def record_pages(out, pages=PAGES, layouts=LAYOUTS):
+    ensure_exports(out)
+    pages[os.path.normpath(out)] = page_stats(out)
+    layouts[os.path.normpath(out)] = layout_of(out)
+
 
-    # 读取所有的csv文件，合并到一起
+def update_feeds(out, batch_num, changed):
+    """分区有更新，或者还没有订阅文件时，生成rss/atom/json订阅"""
+    # 没有任何数据的时候没有分页
+    if batch_num > 0 and (changed or not has_feeds(out)):
+        write_feeds(out, SPLIT)
+
+
+def merge_frame(out, df, duplicate_set=set()):
+    """新数据df合并到out，返回页数；不读fetch目录，可以放到其他进程里执行"""
+    # fetch可能拿不到数据，但是也会创建对应的目录，所以df可能为None
+    # 没有new.csv或者new.csv为空，说明没有更新，已有的分页不用重写
+    if df is None or len(df) <= 0:
+        return page_count(out)
+    if PAGE_LAYOUT == LAYOUT_STABLE and not duplicate_set:
+        return append_frame(out, df, duplicate_set)
+    if MERGE_STREAM_PAGES and layout_of(out) == LAYOUT_CUT and page_count(out) >= MERGE_STREAM_PAGES:
+        return stream_merge(out, df, SPLIT, duplicate_set)
+
+    # 读取已有的全部数据合并到一起，有parquet历史时不用逐页解析csv
     # 分页后，导致每个文件都会变
-    idx = 1
-    while True:
-        # 为什么之前是idx + 1 ????
-        batch_file = out + str(idx) + ".csv"
-        idx += 1
-        if not os.path.isfile(batch_file):
-            break
-        df_batch = pandas.read_csv(batch_file, encoding="utf-8")
-        dfs.append(df_batch)
-    # 如果项目大了，这里可以优化，分批次合并，没准要几百万条数据呢
-
-    df = []
-    if dfs:
-        df = pandas.concat(dfs)
-        # 先排序
-        df = df.sort_values(by="timestamp", ascending=False)
-        # 所有的链接肯定不要重复
-        df = df.drop_duplicates(subset=["link"], keep="first")
-        # 发现有人用localhost，肯定不行啦，这样处理有点暴力
-        df = df[~df["link"].str.contains("localhost") | df["link"].str.contains("127.0.0.1")]
-        # 同一个home，同一个timestamp，只保留一个
-        df = df.drop_duplicates(subset=["home", "timestamp"], keep="first")
-        if duplicate_set:
-            df = df.drop_duplicates(subset=list(duplicate_set), keep="first")
+    df = dedupe(pandas.concat([df, read_history(out)]), duplicate_set)
     batch_num = cut(out, df, SPLIT)
+    write_history(out, df)
+    return batch_num
+
+
+def merge_task(task):
+    batch_num = merge_frame(*task)
+    update_feeds(task[0], batch_num, True)
     return batch_num
 
 
-def generator_rss(rss_out, rss_in):
-    batch_file = rss_in + "1.csv"
-    df = pandas.read_csv(batch_file, encoding="utf-8")
-    df_dict = json.loads(df.to_json(orient="records"))
-
-    def rss_not_empty(r):
-        return (
-            {"title", "link", "author", "timestamp"}.issubset(r.keys())
-            and "" not in {r["title"], r["link"], r["author"], r["timestamp"]}
-            and None not in {r["title"], r["link"], r["author"], r["timestamp"]}
-        )
-
-    rss = PyRSS2Gen.RSS2(
-        title="RSSBlog",
-        link="https://rssblog.cn/",
-        description="A Site for Blog RSS.",
-        lastBuildDate=datetime.datetime.now(),
-        items=[
-            PyRSS2Gen.RSSItem(
-                title=r["title"],
-                link=r["link"],
-                author=r["author"],
-                pubDate=datetime.datetime.fromtimestamp(r["timestamp"]),
-            )
-            for r in df_dict
-            if rss_not_empty(r)
-        ],
-    )
-    with open(rss_out + "rss.xml", "wb") as f:
-        rss.write_xml(f, encoding="utf-8")
+def merge_worker(task):
+    """在子进程里merge，连同输出的变化一起交回主进程"""
+    # fork出来的子进程带着主进程的计数，先清掉
+    take_updates()
+    batch_num = merge_frame(*task)
+    # 订阅文件也在子进程里写，写的变化跟着一起交回去
+    update_feeds(task[0], batch_num, True)
+    return batch_num, take_updates()
+
+
+def run_merges(jobs):
+    """执行互不相关的merge，jobs是(out, fetch, duplicate_set)，按jobs的顺序返回页数
+
+    没有更新的分区直接数页数，有更新的分区交给进程池，结果按原来的顺序放回，和串行执行一致
+    """
+    batch_nums = []
+    tasks = []
+    for out, fetch, duplicate_set in jobs:
+        df = read_frame(fetch + "new.csv")
+        if df is None or len(df) <= 0:
+            batch_nums.append(page_count(out))
+            update_feeds(out, batch_nums[-1], False)
+        else:
+            batch_nums.append(None)
+            tasks.append((out, df, duplicate_set))
+    if MERGE_WORKERS > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(MERGE_WORKERS, len(tasks))) as pool:
+            results = list(pool.map(merge_worker, tasks))
+        for _, updates in results:
+            apply_updates(updates)
+        done = iter([batch_num for batch_num, _ in results])
+    else:
+        done = iter([merge_task(task) for task in tasks])
+    for out, _, _ in jobs:
+        record_pages(out)
+    return [next(done) if batch_num is None else batch_num for batch_num in batch_nums]
 
 
 def merge_source(rss_out_source_dir, rss_fetch_source_dir, url=URL):
@@ -103,7 +199,9 @@ def merge_source(rss_out_source_dir, rss_fetch_source_dir, url=URL):
     url["source"] = []
     if not os.path.isdir(rss_out_source_dir):
         os.makedirs(rss_out_source_dir)
-    fetch_source_dirs = os.listdir(rss_fetch_source_dir)
+    fetch_source_dirs = sorted(os.listdir(rss_fetch_source_dir))
+    source_dirs = []
+    jobs = []
     for source_dir in fetch_source_dirs:
         fetch = rss_fetch_source_dir + source_dir + "/"
         out = rss_out_source_dir + source_dir + "/"
@@ -111,7 +209,9 @@ def merge_source(rss_out_source_dir, rss_fetch_source_dir, url=URL):
             continue
         if not os.path.isdir(out):
             os.makedirs(out)
-        batch_num = merge(out, fetch)
+        source_dirs.append(source_dir)
+        jobs.append((out, fetch, set()))
+    for source_dir, batch_num in zip(source_dirs, run_merges(jobs)):
         url["source"].append((source_dir, batch_num))
     print("merge source done")
 
@@ -125,7 +225,6 @@ def merge_all(rss_out_all_dir, rss_fetch_all_dir, url=URL):
     fetch = rss_fetch_all_dir
     out = rss_out_all_dir
     batch_num = merge(out, fetch)
-    generator_rss(out, out)
     url["all"] = batch_num
     print("merge all done")
 
@@ -143,18 +242,21 @@ def merge_member(rss_out_member_dir, rss_fetch_member_dir, url=URL):
     print("merge member done")
 
 
-def merge_date(rss_out_date_dir, rss_fetch_date_dir, url=URL):
-    """合并，把按时间分类的new.csv合并到public/date中，并分页"""
-    print("merge date ...")
-    url["date"] = []
+def date_partitions(rss_out_date_dir, rss_fetch_date_dir):
+    """校验年月目录，返回每个分区的(year, month, out, fetch)
+
+    源没有更新时不会有new.csv，所以除了这次抓到数据的月份，public中已有的月份也要列出来
+    """
     if not os.path.isdir(rss_out_date_dir):
         os.makedirs(rss_out_date_dir)
-    fetch_date_dirs = os.listdir(rss_fetch_date_dir)
-    date = {}
-    for date_dir in fetch_date_dirs:
+    date_dirs = set(os.listdir(rss_out_date_dir))
+    if os.path.isdir(rss_fetch_date_dir):
+        date_dirs |= set(os.listdir(rss_fetch_date_dir))
+    partitions = []
+    for date_dir in sorted(date_dirs):
         fetch = rss_fetch_date_dir + date_dir + "/"
         out = rss_out_date_dir + date_dir + "/"
-        if not os.path.isdir(fetch):
+        if not os.path.isdir(fetch) and not os.path.isdir(out):
             continue
         # Validate date_dir format (should be YYYYMM, 6 characters)
         if len(date_dir) != 6:
@@ -173,40 +275,72 @@ def merge_date(rss_out_date_dir, rss_fetch_date_dir, url=URL):
             print(f"Warning: Non-numeric year/month in directory '{date_dir}', skipping")
             continue
         # Check if fetch directory has valid data before creating output directory
-        if not os.path.exists(fetch + "new.csv"):
+        # 没有新数据、已经有分页的月份照样列出来，run_merges只会数一下页数
+        if not has_frame(fetch + "new.csv") and page_count(out) <= 0:
             print(f"Warning: No data file found in '{date_dir}', skipping")
             continue
         if not os.path.isdir(out):
             os.makedirs(out)
-        batch_num = merge(out, fetch)
+        partitions.append((year, month, out, fetch))
+    return partitions
+
+
+def date_stats(partitions, batch_nums):
+    date = {}
+    for (year, month, _, _), batch_num in zip(partitions, batch_nums):
         if year not in date.keys():
             date[year] = []
         date[year].append((month, batch_num))
-    for year, month in date.items():
-        url["date"].append((year, month))
+    return [(year, month) for year, month in date.items()]
+
+
+def merge_date(rss_out_date_dir, rss_fetch_date_dir, url=URL):
+    """合并，把按时间分类的new.csv合并到public/date中，并分页"""
+    print("merge date ...")
+    partitions = date_partitions(rss_out_date_dir, rss_fetch_date_dir)
+    batch_nums = run_merges([(out, fetch, set()) for _, _, out, fetch in partitions])
+    url["date"] = date_stats(partitions, batch_nums)
     print("merge date done")
 
 
 def merge_user(rss_out_user_dir, rss_fetch_user_dir):
-    """合并，把按用户分类的new.csv合并到public/user中，并分页"""
+    """合并，把按用户分类的new.csv合并到public/user中，并分页
+
+    所有用户的所有分区一起交给run_merges，再按用户把结果放回去
+    """
     print("merge user ...")
     global URL
     URL["user"] = []
     if not os.path.isdir(rss_out_user_dir):
         os.makedirs(rss_out_user_dir)
-    fetch_user_dirs = os.listdir(rss_fetch_user_dir)
-    user_partion = {("all", merge_all), ("date", merge_date), ("member", merge_member)}
+    fetch_user_dirs = sorted(os.listdir(rss_fetch_user_dir))
+    jobs = []
+    layout = []
     for user_dir in fetch_user_dirs:
         fetch = rss_fetch_user_dir + user_dir + "/"
         out = rss_out_user_dir + user_dir + "/"
         url = {"user": user_dir}
-        for partion in user_partion:
-            fetch_dir = fetch + partion[0] + "/"
-            out_dir = out + partion[0] + "/"
+        for partion in USER_PARTITION:
+            fetch_dir = fetch + partion + "/"
+            out_dir = out + partion + "/"
             if not os.path.isdir(fetch_dir):
                 continue
             if not os.path.isdir(out_dir):
                 os.makedirs(out_dir)
-            partion[1](out_dir, fetch_dir, url)
+            if partion == "date":
+                partitions = date_partitions(out_dir, fetch_dir)
+            else:
+                partitions = [(None, None, out_dir, fetch_dir)]
+            duplicate_set = {"home"} if partion == "member" else set()
+            jobs += [(p[2], p[3], duplicate_set) for p in partitions]
+            layout.append((url, partion, partitions))
         URL["user"].append(url)
+
+    batch_nums = iter(run_merges(jobs))
+    for url, partion, partitions in layout:
+        nums = [next(batch_nums) for _ in partitions]
+        if partion == "date":
+            url["date"] = date_stats(partitions, nums)
+            continue
+        url[partion] = nums[0]
     print("merge user done")
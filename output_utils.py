@@ -0,0 +1,115 @@
+# coding=UTF-8
+# public下所有输出文件的写入：内容和上次一样就不写，public分支的提交和上传的文件都会小很多
+
+import os
+import json
+import hashlib
+
+# 输出文件的摘要，路径 -> sha1
+MANIFEST = {}
+# 这次运行中变化的条目，子进程里merge完通过take_updates交回主进程
+UPDATES = {}
+# 这次运行写了多少文件、跳过了多少文件
+COUNTS = {"written": 0, "skipped": 0, "removed": 0}
+
+
+def output_key(path):
+    return os.path.normpath(path)
+
+
+def digest_of(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def load_manifest(path):
+    MANIFEST.clear()
+    try:
+        with open(path, "r") as f:
+            MANIFEST.update(json.load(f))
+    except:
+        pass
+
+
+def dump_manifest(path):
+    # manifest本身每次都写，不记在manifest里
+    with open(path, "w") as f:
+        json.dump(MANIFEST, f, indent=0, sort_keys=True)
+
+
+def file_digest(path):
+    try:
+        with open(path, "rb") as f:
+            return digest_of(f.read())
+    except OSError:
+        return None
+
+
+def record(key, digest):
+    MANIFEST[key] = digest
+    UPDATES[key] = digest
+
+
+def write_output(path, data):
+    """写入bytes，内容没变时跳过，返回是否真的写了"""
+    key = output_key(path)
+    digest = digest_of(data)
+    # 大小不一样肯定变了；manifest里没有的（比如第一次运行）读一次磁盘上的文件
+    if os.path.isfile(path) and os.path.getsize(path) == len(data):
+        known = MANIFEST.get(key) or file_digest(path)
+        if known == digest:
+            if MANIFEST.get(key) != digest:
+                record(key, digest)
+            COUNTS["skipped"] += 1
+            return False
+    with open(path, "wb") as f:
+        f.write(data)
+    record(key, digest)
+    COUNTS["written"] += 1
+    return True
+
+
+def write_text(path, text):
+    return write_output(path, text.encode("utf-8"))
+
+
+def write_json(path, obj, **kwargs):
+    return write_text(path, json.dumps(obj, **kwargs))
+
+
+def write_frame(path, df):
+    return write_text(path, df.to_csv(index=False, sep=","))
+
+
+def remove_output(path):
+    key = output_key(path)
+    if os.path.isfile(path):
+        os.remove(path)
+        COUNTS["removed"] += 1
+    if key in MANIFEST:
+        del MANIFEST[key]
+        UPDATES[key] = None
+
+
+def take_updates():
+    """取出并清空这次的变化，给子进程用"""
+    updates = (dict(UPDATES), dict(COUNTS))
+    UPDATES.clear()
+    for name in COUNTS:
+        COUNTS[name] = 0
+    return updates
+
+
+def apply_updates(updates):
+    changed, counts = updates
+    for key, digest in changed.items():
+        if digest is None:
+            MANIFEST.pop(key, None)
+        else:
+            MANIFEST[key] = digest
+        UPDATES[key] = digest
+    for name, count in counts.items():
+        COUNTS[name] += count
+
+
+def report():
+    return "written %d, skipped %d, removed %d" % (COUNTS["written"], COUNTS["skipped"], COUNTS["removed"])
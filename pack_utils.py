@@ -0,0 +1,112 @@
+# coding=UTF-8
+# 备份文章的打包存储：正文按sha1去重，zlib压缩后追加到N.pack，index.csv记录每个key在哪个包的哪个位置，
+# 读一篇文章只需要seek到对应的位置解压，不用扫整个tar包
+
+import os
+import csv
+import zlib
+import hashlib
+
+PACK_INDEX = "index.csv"
+PACK_COLUMNS = ["key", "digest", "pack", "offset", "length", "size"]
+# 单个包的上限，超过后写新的包，避免单个文件超过github的限制
+PACK_MAX = 64 * 1024 * 1024
+PACK_LEVEL = 6
+
+
+def pack_file(pack_dir, pack):
+    return os.path.join(pack_dir, "%d.pack" % pack)
+
+
+class PackBody:
+    """边下载边算sha1、边压缩，内存里只保留压缩后的内容"""
+
+    def __init__(self):
+        self.sha1 = hashlib.sha1()
+        self.compressor = zlib.compressobj(PACK_LEVEL)
+        self.chunks = []
+        self.size = 0
+
+    def update(self, chunk):
+        self.sha1.update(chunk)
+        self.chunks.append(self.compressor.compress(chunk))
+        self.size += len(chunk)
+
+    def finish(self):
+        self.chunks.append(self.compressor.flush())
+        return self.sha1.hexdigest(), b"".join(self.chunks), self.size
+
+
+class PackStore:
+    """只追加的打包存储；put之后要flush才会写到index.csv"""
+
+    def __init__(self, pack_dir):
+        self.pack_dir = pack_dir
+        # key -> digest
+        self.keys = {}
+        # digest -> (pack, offset, length, size)
+        self.objects = {}
+        self.pending = []
+        self.pack = 1
+        self.load()
+
+    def load(self):
+        path = os.path.join(self.pack_dir, PACK_INDEX)
+        if os.path.isfile(path):
+            with open(path, "r", newline="", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    location = tuple(int(row[name]) for name in PACK_COLUMNS[2:])
+                    self.keys[row["key"]] = row["digest"]
+                    self.objects.setdefault(row["digest"], location)
+        while os.path.isfile(pack_file(self.pack_dir, self.pack + 1)):
+            self.pack += 1
+
+    def has(self, key):
+        return key in self.keys
+
+    def put(self, key, data):
+        """保存一篇文章，内容已经存过时只记下key；返回是否写了新的内容"""
+        body = PackBody()
+        body.update(data)
+        return self.put_body(key, body)
+
+    def put_body(self, key, body):
+        digest, compressed, size = body.finish()
+        written = digest not in self.objects
+        if written:
+            path = pack_file(self.pack_dir, self.pack)
+            if os.path.isfile(path) and os.path.getsize(path) + len(compressed) > PACK_MAX:
+                self.pack += 1
+                path = pack_file(self.pack_dir, self.pack)
+            if not os.path.isdir(self.pack_dir):
+                os.makedirs(self.pack_dir)
+            with open(path, "ab") as f:
+                offset = f.tell()
+                f.write(compressed)
+            self.objects[digest] = (self.pack, offset, len(compressed), size)
+        self.keys[key] = digest
+        self.pending.append([key, digest] + list(self.objects[digest]))
+        return written
+
+    def get(self, key):
+        """读出一篇文章，没有时返回None"""
+        digest = self.keys.get(key)
+        if digest is None:
+            return None
+        pack, offset, length, _ = self.objects[digest]
+        with open(pack_file(self.pack_dir, pack), "rb") as f:
+            f.seek(offset)
+            return zlib.decompress(f.read(length))
+
+    def flush(self):
+        """把新的key追加到index.csv"""
+        if not self.pending:
+            return
+        path = os.path.join(self.pack_dir, PACK_INDEX)
+        header = not os.path.isfile(path)
+        with open(path, "a", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            if header:
+                writer.writerow(PACK_COLUMNS)
+            writer.writerows(self.pending)
+        self.pending = []
@@ -0,0 +1,185 @@
+# coding=UTF-8
+# 分区目录下N.csv分页的读写，merge、fetch、backup都通过这里访问分页
+
+import io
+import os
+import json
+import math
+import pandas
+from output_utils import digest_of, write_output, write_json, remove_output
+
+# 分区的分页信息
+PAGE_META = "pages.json"
+# 默认的分页方式：1.csv是最新的一页，每次有新数据时所有分页都会重写
+LAYOUT_CUT = "cut"
+# 稳定分页：1.csv是最旧的一页，写满的分页不再改变，只有最后一页（head）和新增的分页会写
+LAYOUT_STABLE = "stable"
+# pages.json里每一页的统计，stats.json里也是这个顺序
+PAGE_FIELDS = ("rows", "newest", "oldest", "hash")
+
+# 除了N.csv之外，每一页还要导出的格式：json是一个数组，ndjson每行一条，timestamp都是整数
+PAGE_EXPORT_JSON = "json"
+PAGE_EXPORT_NDJSON = "ndjson"
+PAGE_EXPORT_FORMATS = (PAGE_EXPORT_JSON, PAGE_EXPORT_NDJSON)
+PAGE_EXPORTS = ()
+
+# 这次merge写过的分页的统计，finish_pages时写到pages.json
+_written = {}
+
+
+def page_file(out, idx, ext="csv"):
+    return out + str(idx) + "." + ext
+
+
+def page_count(out):
+    """已经分好的页数"""
+    idx = 0
+    while os.path.isfile(page_file(out, idx + 1)):
+        idx += 1
+    return idx
+
+
+def load_meta(out):
+    try:
+        with open(out + PAGE_META, "r") as f:
+            return json.load(f)
+    except:
+        return {}
+
+
+def dump_meta(out, meta):
+    write_json(out + PAGE_META, meta)
+
+
+def layout_of(out):
+    return load_meta(out).get("layout", LAYOUT_CUT)
+
+
+def page_info(df, data):
+    """按PAGE_FIELDS返回一页的统计，hash是csv内容的sha1前16位"""
+
+    def timestamp(value):
+        return None if value is None or math.isnan(value) else float(value)
+
+    timestamps = df["timestamp"].astype("float64") if "timestamp" in df.columns else pandas.Series(dtype="float64")
+    return [len(df), timestamp(timestamps.max()), timestamp(timestamps.min()), digest_of(data)[:16]]
+
+
+def finish_pages(out, layout, batch_num):
+    """分页写完之后，记下分页方式和每一页的统计；没写过的页沿用pages.json里原来的"""
+    meta = load_meta(out)
+    written = _written.pop(out, {})
+    pages = meta.get("pages", [])[:batch_num]
+    for idx in range(1, batch_num + 1):
+        if idx in written:
+            info = written[idx]
+        elif idx <= len(pages):
+            continue
+        else:
+            info = read_info(out, idx)
+        pages[idx - 1 : idx] = [info]
+    meta["layout"] = layout
+    meta["pages"] = pages
+    dump_meta(out, meta)
+
+
+def read_info(out, idx):
+    with open(page_file(out, idx), "rb") as f:
+        data = f.read()
+    return page_info(pandas.read_csv(io.BytesIO(data), encoding="utf-8"), data)
+
+
+def page_stats(out):
+    """每一页的统计；pages.json里没有的（旧的分区）从分页算一次并记下来"""
+    meta = load_meta(out)
+    batch_num = page_count(out)
+    if len(meta.get("pages", [])) != batch_num:
+        meta["pages"] = [read_info(out, idx) for idx in range(1, batch_num + 1)]
+        dump_meta(out, meta)
+    return meta["pages"]
+
+
+def read_page(out, idx, columns=None):
+    return pandas.read_csv(page_file(out, idx), encoding="utf-8", usecols=columns)
+
+
+def page_records(df):
+    """按列转成json用的记录，timestamp是整数，其余是字符串，空值是null"""
+    columns = []
+    for name in df.columns:
+        col = df[name]
+        missing = col.isna().tolist()
+        if name == "timestamp":
+            values = col.astype("float64").tolist()
+            values = [None if m else int(v) for v, m in zip(values, missing)]
+        else:
+            values = [None if m else str(v) for v, m in zip(col.tolist(), missing)]
+        columns.append(values)
+    names = [str(name) for name in df.columns]
+    return [dict(zip(names, row)) for row in zip(*columns)]
+
+
+def write_exports(out, idx, df):
+    """每条记录只序列化一次，json和ndjson共用"""
+    lines = []
+    if PAGE_EXPORTS:
+        lines = [json.dumps(r, ensure_ascii=False, separators=(",", ":")) for r in page_records(df)]
+    for ext in PAGE_EXPORT_FORMATS:
+        path = page_file(out, idx, ext)
+        if ext not in PAGE_EXPORTS:
+            # 关掉的格式不留下过期的文件
+            if os.path.isfile(path):
+                remove_output(path)
+        elif ext == PAGE_EXPORT_JSON:
+            write_output(path, ("[" + ",".join(lines) + "]").encode("utf-8"))
+        else:
+            write_output(path, "".join(line + "\n" for line in lines).encode("utf-8"))
+
+
+def ensure_exports(out):
+    """导出格式改过之后没再变过的分页：补上缺的导出，删掉关掉的格式"""
+    for idx in range(1, page_count(out) + 1):
+        exists = {ext for ext in PAGE_EXPORT_FORMATS if os.path.isfile(page_file(out, idx, ext))}
+        if exists != set(PAGE_EXPORTS):
+            write_exports(out, idx, read_page(out, idx))
+
+
+def write_page(out, idx, df):
+    data = df.to_csv(index=False, sep=",").encode("utf-8")
+    _written.setdefault(out, {})[idx] = page_info(df, data)
+    write_exports(out, idx, df)
+    return write_output(page_file(out, idx), data)
+
+
+def remove_pages(out, start):
+    """删掉从start开始的分页，数据变少时避免留下多余的旧分页"""
+    idx = start
+    while os.path.isfile(page_file(out, idx)):
+        for ext in ("csv",) + PAGE_EXPORT_FORMATS:
+            if os.path.isfile(page_file(out, idx, ext)):
+                remove_output(page_file(out, idx, ext))
+        idx += 1
+
+
+def page_order(out):
+    """按从新到旧的顺序返回页号"""
+    pages = range(1, page_count(out) + 1)
+    if layout_of(out) == LAYOUT_STABLE:
+        return list(reversed(pages))
+    return list(pages)
+
+
+def read_newest(out, rows):
+    """最新的rows条数据，按时间从新到旧；没有数据时返回None"""
+    dfs = []
+    size = 0
+    for idx in page_order(out):
+        if size >= rows:
+            break
+        df = read_page(out, idx)
+        dfs.append(df)
+        size += len(df)
+    if not dfs:
+        return None
+    df = pandas.concat(dfs).sort_values(by="timestamp", ascending=False, kind="mergesort")
+    return df[:rows]
@@ -0,0 +1,163 @@
+# coding=UTF-8
+# public/all的标题和作者的倒排索引，按token的crc32分到SEARCH_SHARDS个文件里，客户端搜索时只下载一个分片
+#
+# 倒排里记的是序号：每一条第一次加进索引时按顺序分配，之后不会再变，和它在all中的位置无关。
+# 比已有数据更旧的数据晚到时（调度推迟的源、新订阅的源），只会分到新的序号，不用重建索引。
+# 已经加进索引的link的hash保存在links.npy中，每次只把这次合并的新数据中还没有的link加进来；
+# 序号对应的数据按SEARCH_DOCS条一个文件放在docs/下：docs/(序号 // SEARCH_DOCS).json的
+# 第(序号 % SEARCH_DOCS)个元素是[link, title, author, timestamp]，客户端不用再换算分页
+
+import re
+import os
+import json
+import zlib
+import numpy
+import pandas
+import unicodedata
+from store_utils import read_history
+from output_utils import write_json, remove_output
+from index_utils import INDEX_LINK, hash_columns, contains, dump_index
+from merge_utils import dedupe
+
+SEARCH_SHARDS = 64
+SEARCH_META = "meta.json"
+# 每个docs文件保存多少个序号对应的数据
+SEARCH_DOCS = 1000
+SEARCH_DOCS_DIR = "docs/"
+SEARCH_FIELDS = ("title", "author")
+# 中日韩的字符按两个字一组切，连续的字母数字整个作为一个token
+CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+TOKEN_RE = re.compile("[%s]+|[0-9a-z]+" % CJK)
+CJK_RE = re.compile("[%s]" % CJK)
+
+
+def tokenize(text):
+    """NFKC、小写之后切词；中文等按二元切分，只有一个字时就是这个字，单个字母不要"""
+    tokens = set()
+    if text is None or text != text:
+        return tokens
+    text = unicodedata.normalize("NFKC", str(text)).lower()
+    for run in TOKEN_RE.findall(text):
+        if CJK_RE.match(run):
+            if len(run) == 1:
+                tokens.add(run)
+            tokens.update(run[i : i + 2] for i in range(len(run) - 1))
+        elif len(run) > 1 or run.isdigit():
+            tokens.add(run)
+    return tokens
+
+
+def shard_of(token):
+    return zlib.crc32(token.encode("utf-8")) % SEARCH_SHARDS
+
+
+def shard_file(search_dir, shard):
+    return search_dir + str(shard) + ".json"
+
+
+def load_shard(search_dir, shard):
+    try:
+        with open(shard_file(search_dir, shard), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except:
+        return {}
+
+
+def docs_file(search_dir, chunk):
+    return search_dir + SEARCH_DOCS_DIR + str(chunk) + ".json"
+
+
+def load_docs(search_dir, chunk):
+    try:
+        with open(docs_file(search_dir, chunk), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except:
+        return []
+
+
+def doc_of(link, title, author, timestamp):
+    def text(value):
+        return None if value is None or value != value else str(value)
+
+    timestamp = None if timestamp is None or timestamp != timestamp else int(float(timestamp))
+    return [text(link), text(title), text(author), timestamp]
+
+
+def update_search(search_dir, out, df=None):
+    """把这次合并到out的新数据df中还没有加进索引的加进来，分配新的序号
+
+    只在索引的格式变了或者文件缺失时读out的全部数据重建；df先按merge的规则去重，
+    和out中已有数据重复而被merge丢掉的（同一个home同一个时间）仍然会加进索引
+    """
+    if not os.path.isdir(search_dir + SEARCH_DOCS_DIR):
+        os.makedirs(search_dir + SEARCH_DOCS_DIR)
+    try:
+        with open(search_dir + SEARCH_META, "r") as f:
+            meta = json.load(f)
+    except:
+        meta = {}
+    start = meta.get("rows", 0)
+    rebuild = meta.get("shards") != SEARCH_SHARDS or meta.get("docs") != SEARCH_DOCS or not os.path.isfile(search_dir + INDEX_LINK)
+    if rebuild:
+        print("search index rebuild")
+        start = 0
+        known = numpy.empty(0, dtype=numpy.uint64)
+    else:
+        known = numpy.load(search_dir + INDEX_LINK)
+
+    columns = ["link", "timestamp"] + list(SEARCH_FIELDS)
+    if rebuild:
+        df = read_history(out, columns)
+    elif df is not None and len(df) > 0:
+        df = dedupe(df)[columns]
+    if df is None:
+        df = pandas.DataFrame(columns=columns)
+    df = df[~contains(known, hash_columns(df, ["link"]))].drop_duplicates(subset=["link"])
+    if not rebuild and len(df) <= 0:
+        return
+    # 按时间从旧到新分配序号，同一时间的保持分页中的先后
+    df = df[::-1].sort_values("timestamp", kind="mergesort")
+
+    if rebuild:
+        shards = {shard: {} for shard in range(SEARCH_SHARDS)}
+    else:
+        shards = {}
+    docs = {}
+    seq = start
+    for values in zip(*[df[name].tolist() for name in ["link"] + list(SEARCH_FIELDS) + ["timestamp"]]):
+        tokens = set()
+        for value in values[1:-1]:
+            tokens |= tokenize(value)
+        for token in tokens:
+            shard = shard_of(token)
+            if shard not in shards:
+                shards[shard] = load_shard(search_dir, shard)
+            shards[shard].setdefault(token, []).append(seq)
+        chunk = seq // SEARCH_DOCS
+        if chunk not in docs:
+            docs[chunk] = [] if rebuild else load_docs(search_dir, chunk)
+        docs[chunk].append(doc_of(*values))
+        seq += 1
+
+    for shard, postings in shards.items():
+        if postings:
+            write_json(shard_file(search_dir, shard), postings, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+        else:
+            remove_output(shard_file(search_dir, shard))
+    for chunk, rows in docs.items():
+        write_json(docs_file(search_dir, chunk), rows, ensure_ascii=False, separators=(",", ":"))
+    if rebuild:
+        # 重建后序号变少时，多出来的docs文件也要删掉
+        chunk = (seq + SEARCH_DOCS - 1) // SEARCH_DOCS
+        while os.path.isfile(docs_file(search_dir, chunk)):
+            remove_output(docs_file(search_dir, chunk))
+            chunk += 1
+    dump_index(search_dir, {INDEX_LINK: numpy.union1d(known, hash_columns(df, ["link"]))})
+    meta = {
+        "shards": SEARCH_SHARDS,
+        "fields": list(SEARCH_FIELDS),
+        "docs": SEARCH_DOCS,
+        "rows": seq,
+    }
+    write_json(search_dir + SEARCH_META, meta, indent=2)
+    print("search index", seq - start, "rows added,", len(shards), "shards written")
@@ -0,0 +1,83 @@
+# coding=UTF-8
+# 分区的完整历史：有pyarrow时以parquet保存一份，merge/backup读历史时不用再逐页解析csv；
+# N.csv分页仍然照常输出给网站用，没有pyarrow或者历史文件过期时从分页读
+
+import io
+import os
+import pandas
+from page_utils import load_meta, dump_meta, page_order, read_page
+from output_utils import write_output, remove_output
+
+try:
+    import pyarrow.parquet  # noqa: F401 pandas.read_parquet/to_parquet要用
+except ImportError:
+    pyarrow = None
+
+# 只用N.csv分页
+STORE_CSV = "csv"
+# 分页之外再保存一份parquet
+STORE_PARQUET = "parquet"
+STORE_BACKEND = STORE_PARQUET if pyarrow else STORE_CSV
+STORE_FILE = "history.parquet"
+# 重复值很多的列，按字典编码保存
+STORE_CATEGORY = ("author", "home", "rss")
+
+
+def to_store(df):
+    """统一类型：timestamp是float64，STORE_CATEGORY是category，其余是字符串"""
+    df = df.reset_index(drop=True)
+    columns = {}
+    for name in df.columns:
+        col = df[name]
+        if name == "timestamp":
+            col = pandas.to_numeric(col, errors="coerce").astype("float64")
+        else:
+            col = col.astype(object).where(col.isna(), col.astype(str))
+            if name in STORE_CATEGORY:
+                col = col.astype("category")
+        columns[name] = col
+    return pandas.DataFrame(columns)
+
+
+def from_store(df):
+    for name in STORE_CATEGORY:
+        if name in df.columns:
+            df[name] = df[name].astype(object)
+    return df
+
+
+def has_history(out):
+    """历史文件存在，并且是和现在的分页一起写的"""
+    if STORE_BACKEND != STORE_PARQUET or not os.path.isfile(out + STORE_FILE):
+        return False
+    return load_meta(out).get("store") == STORE_PARQUET
+
+
+def read_history(out, columns=None):
+    """分区的全部数据，按从新到旧的分页顺序；没有数据时返回None"""
+    if has_history(out):
+        return from_store(pandas.read_parquet(out + STORE_FILE, columns=columns))
+    dfs = [read_page(out, idx, columns) for idx in page_order(out)]
+    return pandas.concat(dfs) if dfs else None
+
+
+def write_history(out, df):
+    """分页写完之后调用，保存和分页一致的历史"""
+    if STORE_BACKEND != STORE_PARQUET:
+        return remove_history(out)
+    buf = io.BytesIO()
+    to_store(df).to_parquet(buf, index=False)
+    write_output(out + STORE_FILE, buf.getvalue())
+    meta = load_meta(out)
+    if meta.get("store") != STORE_PARQUET:
+        meta["store"] = STORE_PARQUET
+        dump_meta(out, meta)
+
+
+def remove_history(out):
+    """分页被其他方式改写之后，历史文件就过期了"""
+    meta = load_meta(out)
+    if "store" in meta:
+        del meta["store"]
+        dump_meta(out, meta)
+    remove_output(out + STORE_FILE)
@@ -0,0 +1,151 @@
+# coding=UTF-8
+# 很大的分区按流式合并：已有的分页本来就按timestamp从新到旧排好，和新数据做k路归并，
+# 边合并边去重边写分页，内存里只有几页数据和去重用的hash；
+# hash是排好序的uint64数组，每行每种去重规则8字节，仍然随分区大小增长，但是不用把分区的数据都读进内存
+
+import numpy
+import pandas
+from collections import deque
+from page_utils import page_count, read_page, write_page, remove_pages, finish_pages, LAYOUT_CUT
+from index_utils import hash_columns, contains, remove_index
+from store_utils import remove_history
+
+
+class FrameStream:
+    """内存里已经排好序的frame"""
+
+    def __init__(self, dfs):
+        self.chunks = deque(dfs)
+
+    def take(self):
+        return self.chunks.popleft() if self.chunks else None
+
+    def done(self):
+        return not self.chunks
+
+
+class PageStream:
+    """按页读cut分页；写第N页之前要先把第N页读进来，避免还没读的分页被覆盖"""
+
+    def __init__(self, out):
+        self.out = out
+        self.count = page_count(out)
+        self.next = 1
+        self.chunks = deque()
+
+    def load_until(self, idx):
+        while self.next <= min(idx, self.count):
+            self.chunks.append(read_page(self.out, self.next))
+            self.next += 1
+
+    def take(self):
+        self.load_until(self.next)
+        return self.chunks.popleft() if self.chunks else None
+
+    def done(self):
+        return not self.chunks and self.next > self.count
+
+
+def sort_key(df):
+    return df["timestamp"].astype("float64").fillna(-numpy.inf)
+
+
+class SeenHashes:
+    """已经见过的hash，分成几层排好序的uint64数组，越往后越小
+
+    每批只有一页左右，直接并进一个大数组每次都要复制整个数组；新的一层和后面不比它大的层合并，
+    每个hash只会被复制O(log n)次
+    """
+
+    def __init__(self):
+        self.levels = []
+
+    def contains(self, hashes):
+        mask = numpy.zeros(len(hashes), dtype=bool)
+        for level in self.levels:
+            mask |= contains(level, hashes)
+        return mask
+
+    def add(self, hashes):
+        level = numpy.unique(numpy.asarray(hashes, dtype=numpy.uint64))
+        while self.levels and len(self.levels[-1]) <= len(level):
+            level = numpy.union1d(self.levels.pop(), level)
+        self.levels.append(level)
+
+
+def seen_mask(hashes, seen):
+    """每一行是否已经出现过（包括本批前面的行）"""
+    mask = pandas.Series(hashes).duplicated().to_numpy(copy=True)
+    mask |= seen.contains(hashes)
+    return mask
+
+
+class Deduper:
+    """按从新到旧的顺序逐批去重，规则和merge_utils.dedupe一样，已经见过的只保留hash"""
+
+    def __init__(self, duplicate_set=set()):
+        self.subsets = [["home", "timestamp"]]
+        if duplicate_set:
+            self.subsets.append(sorted(duplicate_set))
+        self.links = SeenHashes()
+        self.keys = [SeenHashes() for _ in self.subsets]
+
+    def filter(self, df):
+        hashes = hash_columns(df, ["link"])
+        df = df[~seen_mask(hashes, self.links)]
+        self.links.add(hashes)
+        df = df[~df["link"].str.contains("localhost") | df["link"].str.contains("127.0.0.1")]
+        for subset, seen in zip(self.subsets, self.keys):
+            hashes = hash_columns(df, subset)
+            mask = ~seen_mask(hashes, seen)
+            df = df[mask]
+            seen.add(hashes[mask])
+        return df
+
+
+def merge_streams(streams):
+    """k路归并，每次产出一批按timestamp从新到旧排好的数据"""
+    buffers = [None] * len(streams)
+    while True:
+        for i, stream in enumerate(streams):
+            if buffers[i] is None or len(buffers[i]) <= 0:
+                buffers[i] = stream.take()
+        active = [i for i, b in enumerate(buffers) if b is not None and len(b) > 0]
+        if not active:
+            return
+        # 还有后续数据的流里，每个缓冲区最旧的时间取最大值，不比它旧的数据都可以先输出
+        bounds = [sort_key(buffers[i]).iloc[-1] for i in active if not streams[i].done()]
+        bound = max(bounds) if bounds else -numpy.inf
+        parts = []
+        for i in active:
+            mask = (sort_key(buffers[i]) >= bound).to_numpy()
+            parts.append(buffers[i][mask])
+            buffers[i] = buffers[i][~mask]
+        chunk = pandas.concat(parts)
+        yield chunk.iloc[numpy.argsort(-sort_key(chunk).to_numpy(), kind="mergesort")]
+
+
+def stream_merge(out, df, batch, duplicate_set=set()):
+    """新数据df流式合并到cut分页的out，返回页数"""
+    df = df.iloc[numpy.argsort(-sort_key(df).to_numpy(), kind="mergesort")]
+    pages = PageStream(out)
+    deduper = Deduper(duplicate_set)
+    pending = df[:0]
+    batch_num = 0
+    for chunk in merge_streams([FrameStream([df]), pages]):
+        pending = pandas.concat([pending, deduper.filter(chunk)])
+        while len(pending) >= batch:
+            batch_num += 1
+            pages.load_until(batch_num)
+            write_page(out, batch_num, pending[:batch])
+            pending = pending[batch:]
+    if len(pending) > 0:
+        batch_num += 1
+        pages.load_until(batch_num)
+        write_page(out, batch_num, pending)
+    remove_pages(out, batch_num + 1)
+    finish_pages(out, LAYOUT_CUT, batch_num)
+    # 流式合并不会有完整的数据，索引和历史文件都过期了
+    remove_index(out)
+    remove_history(out)
+    return batch_num